@@ -0,0 +1,216 @@
+# AI CLIENT - the one place that talks HTTP to Gemini
+#
+# One pooled keep-alive requests.Session per worker process (so calls reuse TLS
+# connections), connect/read timeouts on every call, a concurrency limit so a
+# slow Gemini can't tie up every thread, and a circuit breaker that fails fast
+# for a while after repeated errors. Latency is recorded per call type.
+#
+# Everything is configured from the environment; set GEMINI_API_BASE to point
+# the app (or check_models.py) at a local stub such as bench/stub_gemini.py.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+
+class AIClientError(Exception):
+    pass
+
+
+class CircuitOpenError(AIClientError):
+    pass
+
+
+class ConcurrencyLimitError(AIClientError):
+    pass
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, failed=False):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.total += seconds
+            self.count += 1
+            self.failures += failed
+
+    def snapshot(self):
+        with self._lock:
+            return {'count': self.count, 'sum': self.total, 'failures': self.failures,
+                    'buckets': dict(zip(self.buckets, self.counts))}
+
+
+class CircuitBreaker:
+    # closed -> (N failures in a row) -> open -> (reset_timeout) -> half-open -> one trial call
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def cancel(self):
+        # An allowed call never went out (e.g. no free slot) - let the next one be the trial
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class GeminiClient:
+    def __init__(self, api_base='https://generativelanguage.googleapis.com', api_key=None, model='gemini-2.5-flash',
+                 connect_timeout=5.0, read_timeout=60.0, max_concurrency=8, queue_timeout=10.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.api_base = api_base.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = {}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            api_base=environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com'),
+            api_key=environ.get('GEMINI_API_KEY'),
+            model=environ.get('GEMINI_MODEL', 'gemini-2.5-flash'),
+            connect_timeout=float(environ.get('GEMINI_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(environ.get('GEMINI_READ_TIMEOUT', 60)),
+            max_concurrency=int(environ.get('GEMINI_MAX_CONCURRENCY', 8)),
+            queue_timeout=float(environ.get('GEMINI_QUEUE_TIMEOUT', 10)),
+            failure_threshold=int(environ.get('GEMINI_BREAKER_FAILURES', 5)),
+            reset_timeout=float(environ.get('GEMINI_BREAKER_RESET', 30)),
+        )
+
+    def url(self, method='generateContent', model=None):
+        # The key goes in a header (see session), never the URL: request errors quote the URL
+        return f"{self.api_base}/v1/models/{model or self.model}:{method}"
+
+    @property
+    def session(self):
+        # A forked gunicorn worker must not share its parent's sockets
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_concurrency, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    if self.api_key:
+                        session.headers['x-goog-api-key'] = self.api_key
+                    self._session, self._session_pid = session, pid
+        return self._session
+
+    def _histogram(self, name):
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency.setdefault(name, LatencyHistogram())
+        return histogram
+
+    @contextmanager
+    def _call(self, name):
+        # Breaker check, concurrency slot, latency and outcome bookkeeping around one call
+        if not self.breaker.allow():
+            raise CircuitOpenError('Gemini is failing right now; not calling it for a little while.')
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.breaker.cancel()
+            raise ConcurrencyLimitError(f'Too many Gemini calls in flight (limit {self.max_concurrency}).')
+        start = time.perf_counter()
+        outcome = {'failed': True}
+        try:
+            yield outcome
+        finally:
+            self._slots.release()
+            self._histogram(name).observe(time.perf_counter() - start, outcome['failed'])
+            if outcome['failed']:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    @staticmethod
+    def _is_failure(status_code):
+        # 429s and 5xx mean Gemini is struggling; other 4xx are our own fault
+        return status_code == 429 or status_code >= 500
+
+    def request(self, name, method, url, **kwargs):
+        with self._call(name) as outcome:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            outcome['failed'] = self._is_failure(response.status_code)
+            return response
+
+    def generate(self, payload, name='generate', model=None):
+        return self.request(name, 'POST', self.url('generateContent', model), json=payload)
+
+    @contextmanager
+    def stream_generate(self, payload, name='stream', model=None):
+        # Server-sent-events variant of generate(); the slot is held until the body is read
+        url = f"{self.url('streamGenerateContent', model)}?alt=sse"
+        with self._call(name) as outcome:
+            response = self.session.post(url, json=payload, timeout=self.timeout, stream=True)
+            try:
+                outcome['failed'] = self._is_failure(response.status_code)
+                yield response
+            except requests.RequestException:
+                outcome['failed'] = True
+                raise
+            finally:
+                response.close()
+
+    def list_models(self):
+        return self.request('list_models', 'GET', f"{self.api_base}/v1/models")
+
+    def stats(self):
+        return {'breaker': self.breaker.state, 'latency': {name: h.snapshot() for name, h in list(self.latency.items())}}
+
+
+client = GeminiClient.from_env()
@@ -0,0 +1,305 @@
+# AI PROVIDERS - journey planning and photo verification behind one interface
+#
+# The app only talks to `ai` (an AIProviders instance in app.py); which backend
+# answers is a deployment setting:
+#
+#   AI_PROVIDER=gemini   the real thing (gemini.GeminiProvider, through ai_client)
+#   AI_PROVIDER=local    LocalPlanner: builds a valid plan instantly from goal
+#                        keywords, no network. Photos get AI_LOCAL_VERDICT.
+#   AI_PROVIDER=replay   ReplayProvider: answers from a file of recorded responses
+#                        (AI_REPLAY_FILE); anything not in it is "unavailable".
+#
+# AI_RECORD_FILE=path appends every answer the provider gives to that file, in
+# the format ReplayProvider reads. AI_PLAN_FALLBACK=local hands journey planning
+# to the LocalPlanner whenever the provider is unavailable (circuit open, every
+# slot busy, timeouts, replay miss) instead of retrying later. Photos never fall
+# back: a template can't tell whether a room is clean.
+
+import hashlib
+import json
+import os
+import re
+import threading
+from plan_cache import normalize_goal
+
+
+class AIError(Exception):
+    # The provider answered but the answer is unusable
+    pass
+
+
+class AIUnavailable(AIError):
+    # No answer right now - worth retrying later or falling back
+    pass
+
+
+class AIProvider:
+    name = None
+
+    def generate_journey_plan(self, goal):
+        raise NotImplementedError
+
+    def stream_journey_plan(self, goal):
+        # ('title', str), ('milestone', dict) ..., ('plan', dict); providers that can't stream
+        # produce the whole plan first
+        plan = self.generate_journey_plan(goal)
+        yield 'title', plan['journey_title']
+        for ms_data in plan['milestones']:
+            yield 'milestone', ms_data
+        yield 'plan', plan
+
+    def verify_photo(self, title, mime_type, base64_data):
+        raise NotImplementedError
+
+    def verify_photo_batches(self, photos, per_call=4, parallel=2):
+        # photos: [(title, mime_type, base64_data)] -> True/False per photo, None when unanswered
+        results = []
+        for photo in photos:
+            try:
+                results.append(self.verify_photo(*photo))
+            except AIError:
+                results.append(None)
+        return results
+
+    def stats(self):
+        return {}
+
+
+# Theme keywords, weekly goals (spread evenly over the weeks) and five tasks per weekly goal.
+# '{subject}' is the user's goal without the duration.
+LOCAL_THEMES = [
+    (('run', 'marathon', 'gym', 'fit', 'exercise', 'workout', 'weight', 'muscle', 'yoga', 'swim', 'cycle'), 'Fitness Journey', [
+        ('Build the habit with short, easy sessions: {subject}', ['Do a 20 minute easy session', 'Stretch for 10 minutes', 'Plan this week\'s workout times', 'Take a 30 minute walk', 'Write down how your body feels']),
+        ('Add volume and consistency', ['Do a 30 minute session', 'Try one new exercise', 'Drink 2 litres of water', 'Do a mobility routine', 'Log every workout this week']),
+        ('Push intensity: {subject}', ['Do an interval session', 'Increase one workout by 10%', 'Prepare a healthy meal', 'Get 8 hours of sleep', 'Review your progress log']),
+        ('Consolidate and test yourself', ['Do your longest session yet', 'Do a recovery session', 'Measure your progress against week 1', 'Plan next month\'s routine', 'Celebrate with an active day out']),
+    ]),
+    (('learn', 'study', 'language', 'code', 'coding', 'programming', 'python', 'exam', 'course', 'read', 'skill'), 'Learning Journey', [
+        ('Lay the foundations: {subject}', ['Set up your study space and materials', 'Study the basics for 30 minutes', 'Write a one-page summary', 'Make 20 flashcards', 'Explain one idea to a friend']),
+        ('Practise every day', ['Do 45 minutes of focused practice', 'Solve five practice exercises', 'Review yesterday\'s flashcards', 'Watch one tutorial and take notes', 'Find one thing you don\'t understand and look it up']),
+        ('Apply it to something real: {subject}', ['Start a small project', 'Work on the project for an hour', 'Ask for feedback on your work', 'Fix the weakest part of the project', 'Write down what you learned']),
+        ('Review and show what you know', ['Take a practice test', 'Review every mistake', 'Finish the project', 'Teach one topic to someone else', 'Plan your next learning goal']),
+    ]),
+    (('clean', 'declutter', 'organize', 'organise', 'tidy', 'room', 'house', 'home', 'garden', 'kitchen'), 'Home Reset Journey', [
+        ('Clear the clutter: {subject}', ['Clean your desk', 'Declutter one drawer', 'Organize your wardrobe', 'Take out recycling', 'Make a list of problem areas']),
+        ('Room by room', ['Clean the kitchen counters', 'Organize the bathroom shelf', 'Clean your bedroom', 'Donate five items', 'Wipe all light switches and handles']),
+        ('Deep clean', ['Clean the fridge', 'Clean the windows', 'Organize the storage cupboard', 'Clean under the bed', 'Wash all bedding']),
+        ('Keep it that way', ['Make a weekly cleaning rota', 'Clean for 15 minutes', 'Organize your entryway', 'Tidy before bed', 'Clean the room you use most']),
+    ]),
+    (('sleep', 'diet', 'eat', 'healthy', 'health', 'water', 'meditat', 'stress', 'mindful', 'sugar'), 'Healthy Habits Journey', [
+        ('Notice your habits: {subject}', ['Track what you eat today', 'Go to bed at a fixed time', 'Drink a glass of water on waking', 'Meditate for 5 minutes', 'Write down your biggest trigger']),
+        ('Swap one habit at a time', ['Cook a healthy dinner', 'Replace one snack with fruit', 'No screens 30 minutes before bed', 'Take a walk after lunch', 'Meditate for 10 minutes']),
+        ('Make it routine', ['Prepare tomorrow\'s meals', 'Keep the same bedtime all week', 'Do a breathing exercise when stressed', 'Cook something new and healthy', 'Review your week\'s tracking']),
+        ('Lock it in', ['Plan next week\'s meals', 'Meditate for 15 minutes', 'Share your progress with a friend', 'Make a healthy treat', 'Write your rules for the next month']),
+    ]),
+    (('save', 'saving', 'money', 'budget', 'debt', 'invest', 'spend', 'finance'), 'Money Journey', [
+        ('See where the money goes: {subject}', ['List every subscription you pay for', 'Track every purchase today', 'Check your bank balance', 'Write down your savings target', 'Sort last month\'s spending into categories']),
+        ('Cut the leaks', ['Cancel one subscription you don\'t use', 'Cook at home instead of eating out', 'Set a daily spending limit', 'Compare one bill with cheaper options', 'Move a small amount into savings']),
+        ('Automate', ['Set up an automatic transfer to savings', 'Make a simple monthly budget', 'Build a shopping list before buying', 'Have a no-spend day', 'Review your budget against reality']),
+        ('Plan ahead', ['Plan next month\'s budget', 'Check progress towards your target', 'Have a no-spend day', 'Sell one thing you don\'t need', 'Write down your next money goal']),
+    ]),
+    (('write', 'writing', 'draw', 'drawing', 'paint', 'music', 'guitar', 'piano', 'sing', 'photo', 'craft', 'art'), 'Creative Journey', [
+        ('Get started: {subject}', ['Set up a space to create', 'Create something for 20 minutes', 'Collect five pieces that inspire you', 'Learn one basic technique', 'Draw or write without judging it']),
+        ('Create every day', ['Create for 30 minutes', 'Copy a piece you admire', 'Try a new tool or style', 'Share one piece with a friend', 'Make a small piece in one sitting']),
+        ('Make a real piece', ['Plan a bigger piece', 'Work on it for an hour', 'Ask for feedback', 'Build the hardest part', 'Polish the details']),
+        ('Finish and share', ['Finish your piece', 'Share it online or with family', 'Make a quick bonus piece', 'Review how far you have come', 'Plan your next project']),
+    ]),
+]
+LOCAL_DEFAULT_THEME = ('Your Journey', [
+    ('Get clear on the goal: {subject}', ['Write down why this goal matters', 'Break the goal into small steps', 'Spend 20 minutes on the first step', 'Remove one obstacle', 'Tell someone about your goal']),
+    ('Build momentum', ['Spend 30 minutes on your goal', 'Finish one small step', 'Make a checklist for the week', 'Review what slowed you down', 'Reward yourself for progress']),
+    ('Go deeper', ['Spend 45 minutes on your goal', 'Tackle the hardest step', 'Ask someone for advice', 'Create a plan for the last stretch', 'Track your progress']),
+    ('Finish strong', ['Complete a major step', 'Review everything you achieved', 'Fix what is left', 'Share the result', 'Set your next goal']),
+])
+_DURATION = re.compile(r'(\d+)\s*(day|week|month)s?\b')
+
+
+class LocalPlanner(AIProvider):
+    name = 'local'
+
+    def __init__(self, verdict=None, max_weeks=12):
+        # verdict: 'verified' / 'rejected' for every photo, None = can't check photos
+        self.verdict = verdict
+        self.max_weeks = max_weeks
+
+    def weeks(self, goal):
+        match = _DURATION.search(goal.lower())
+        if not match:
+            return 4
+        n, unit = int(match.group(1)), match.group(2)
+        weeks = {'day': -(-n // 7), 'week': n, 'month': n * 4}[unit]
+        return max(1, min(weeks, self.max_weeks))
+
+    def generate_journey_plan(self, goal):
+        words = normalize_goal(goal)
+        subject = ' '.join(_DURATION.sub(' ', words).replace(' in ', ' ').split()) or 'your goal'
+        title, phases = next(((title, phases) for keywords, title, phases in LOCAL_THEMES
+                              if any(re.search(rf'\b{keyword}', words) for keyword in keywords)), LOCAL_DEFAULT_THEME)
+        weeks = self.weeks(goal)
+        milestones = []
+        for week in range(1, weeks + 1):
+            weekly_goal, tasks = phases[(week - 1) * len(phases) // weeks]
+            milestones.append({'week': week, 'weekly_goal': weekly_goal.format(subject=subject), 'daily_tasks': list(tasks)})
+        # 'planner' keeps these plans out of the plan cache, so a real one replaces them later
+        return {'journey_title': f'{title}: {subject[:80].capitalize()}', 'milestones': milestones, 'planner': self.name}
+
+    def verify_photo(self, title, mime_type, base64_data):
+        if self.verdict is None:
+            raise AIUnavailable('The local planner cannot check photos.')
+        return self.verdict == 'verified'
+
+
+def journey_key(goal):
+    return normalize_goal(goal)
+
+
+def photo_key(title, base64_data):
+    return hashlib.sha256(f'{title}\0{base64_data}'.encode()).hexdigest()
+
+
+class ReplayProvider(AIProvider):
+    # Reads a JSON-lines file of {"kind": "journey"|"photo", "key": ..., "result": ...} (see Recorder)
+    name = 'replay'
+
+    def __init__(self, path):
+        self.path = path
+        self.misses = 0
+        self._responses = None
+        self._lock = threading.Lock()
+
+    @property
+    def responses(self):
+        if self._responses is None:
+            with self._lock:
+                if self._responses is None:
+                    responses = {}
+                    if os.path.exists(self.path):
+                        with open(self.path) as f:
+                            for line in f:
+                                if line.strip():
+                                    record = json.loads(line)
+                                    responses[record['kind'], record['key']] = record['result']
+                    self._responses = responses
+        return self._responses
+
+    def _replay(self, kind, key):
+        try:
+            return self.responses[kind, key]
+        except KeyError:
+            self.misses += 1
+            raise AIUnavailable(f'No recorded {kind} response.')
+
+    def generate_journey_plan(self, goal):
+        return self._replay('journey', journey_key(goal))
+
+    def verify_photo(self, title, mime_type, base64_data):
+        return self._replay('photo', photo_key(title, base64_data))
+
+    def stats(self):
+        return {'recorded': len(self.responses), 'misses': self.misses}
+
+
+class Recorder(AIProvider):
+    # Passes everything to `provider` and appends its answers to `path` for ReplayProvider
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.name = provider.name
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, kind, key, result):
+        line = json.dumps({'kind': kind, 'key': key, 'result': result})
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+    def generate_journey_plan(self, goal):
+        plan = self.provider.generate_journey_plan(goal)
+        self._record('journey', journey_key(goal), plan)
+        return plan
+
+    def stream_journey_plan(self, goal):
+        for kind, value in self.provider.stream_journey_plan(goal):
+            if kind == 'plan':
+                self._record('journey', journey_key(goal), value)
+            yield kind, value
+
+    def verify_photo(self, title, mime_type, base64_data):
+        verified = self.provider.verify_photo(title, mime_type, base64_data)
+        self._record('photo', photo_key(title, base64_data), verified)
+        return verified
+
+    def verify_photo_batches(self, photos, per_call=4, parallel=2):
+        results = self.provider.verify_photo_batches(photos, per_call, parallel)
+        for (title, _, base64_data), verified in zip(photos, results):
+            if verified is not None:
+                self._record('photo', photo_key(title, base64_data), verified)
+        return results
+
+    def stats(self):
+        return self.provider.stats()
+
+
+class AIProviders:
+    def __init__(self, app=None):
+        self.provider = None
+        self.fallback = None
+        self.fallbacks = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AI_PROVIDER', 'gemini')
+        app.config.setdefault('AI_PLAN_FALLBACK', '')
+        app.config.setdefault('AI_REPLAY_FILE', os.path.join(app.instance_path, 'ai_responses.jsonl'))
+        app.config.setdefault('AI_RECORD_FILE', '')
+        app.config.setdefault('AI_LOCAL_VERDICT', '')
+        self.provider = self.create(app.config['AI_PROVIDER'], app.config)
+        if app.config['AI_RECORD_FILE']:
+            self.provider = Recorder(self.provider, app.config['AI_RECORD_FILE'])
+        if app.config['AI_PLAN_FALLBACK'] and app.config['AI_PLAN_FALLBACK'] != app.config['AI_PROVIDER']:
+            self.fallback = self.create(app.config['AI_PLAN_FALLBACK'], app.config)
+        app.extensions['ai'] = self
+
+    @staticmethod
+    def create(name, config):
+        if name == 'gemini':
+            from gemini import GeminiProvider
+            return GeminiProvider()
+        if name == 'local':
+            return LocalPlanner(verdict=config['AI_LOCAL_VERDICT'] or None)
+        if name == 'replay':
+            return ReplayProvider(config['AI_REPLAY_FILE'])
+        raise ValueError(f'Unknown AI provider {name!r} (expected gemini, local or replay).')
+
+    def generate_journey_plan(self, goal):
+        try:
+            return self.provider.generate_journey_plan(goal)
+        except AIUnavailable:
+            if self.fallback is None:
+                raise
+            self.fallbacks += 1
+        return self.fallback.generate_journey_plan(goal)
+
+    def stream_journey_plan(self, goal):
+        # Falls back only if nothing has arrived yet; a stream that dies halfway is retried as usual
+        started = False
+        try:
+            for event in self.provider.stream_journey_plan(goal):
+                started = True
+                yield event
+            return
+        except AIUnavailable:
+            if self.fallback is None or started:
+                raise
+            self.fallbacks += 1
+        yield from self.fallback.stream_journey_plan(goal)
+
+    def verify_photo(self, title, mime_type, base64_data):
+        return self.provider.verify_photo(title, mime_type, base64_data)
+
+    def verify_photo_batches(self, photos, per_call=4, parallel=2):
+        return self.provider.verify_photo_batches(photos, per_call, parallel)
+
+    def stats(self):
+        return {'provider': self.provider.name, 'fallback': self.fallback and self.fallback.name,
+                'fallbacks': self.fallbacks, **self.provider.stats()}
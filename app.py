@@ -2,103 +2,127 @@
 
 import random
 import os
-import requests
 import json
-import re
-from flask import Flask, render_template, request, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from datetime import datetime, date
-import base64
+import time
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from werkzeug.exceptions import RequestEntityTooLarge
+from datetime import date
+from sqlalchemy.orm import selectinload
+from models import db, User, Target, Group, GroupTarget, Journey, Milestone, DailyTask, Job, group_target_completions
+from jobs import JobQueue, RetryJob
+from plan_cache import PlanCache
+from materialize import materialize_journey, add_milestones, start_journey, activate_journey, discard_journey
+from query_counter import query_budget
+from leaderboard import Leaderboard
+from verification_cache import VerificationCache
+from migrations import Migrations
+from points import PointsLedger, insert_ignore
+from group_cache import GroupPageCache
+from user_cache import UserCache
+from metrics import Metrics
+from rollover import DailyRollover
+from startup import Startup
+import group_cache
+import query_counter
+import gemini
+from ai_provider import AIProviders, AIUnavailable
+import images
 
 # Configuration 
-# SECURE: Read the API key from an environment variable on the server
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-GEMINI_VISION_API_URL = f"https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = { 'png','jpg','jpeg'}
+# What users see when the AI can't be reached; the underlying error only goes to the log
+AI_UNAVAILABLE_MESSAGE = 'The AI service is not responding right now. Please try again in a little while.'
+
+class UploadRequest(Request):
+    # Bodies are refused past MAX_CONTENT_LENGTH before they are read; routes listed in
+    # UPLOAD_LIMITS (endpoint -> config key) take that larger limit instead
+    @property
+    def max_content_length(self):
+        key = UPLOAD_LIMITS.get(self.endpoint)
+        return app.config[key] if key else super().max_content_length
+
+# Batch verification takes up to VERIFY_BATCH_MAX photos in one form
+UPLOAD_LIMITS = {'verify_batch': 'VERIFY_BATCH_MAX_CONTENT_LENGTH'}
 
 # App and Database Setup 
-app = Flask(__name__)
+# The templates live next to app.py rather than in a templates/ folder
+app = Flask(__name__, template_folder='.')
+app.request_class = UploadRequest
 basedir = os.path.abspath(os.path.dirname(__file__))
+# Created on first use (startup.py), like the database itself
 instance_dir = os.path.join(basedir,'instance')
-if not os.path.exists(instance_dir):
-    os.makedirs(instance_dir)
 
 app.config['SECRET_KEY'] = 'my-super-secret-key-for-this-hackathon-final-ai'
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(instance_dir,"db.sqlite")}'
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.join(instance_dir,"db.sqlite")}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER']= UPLOAD_FOLDER
-db = SQLAlchemy(app)
-
-# All the models (User, Target, Group, etc.) go here...
-# ... (This code is unchanged)
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
-    password_hash = db.Column(db.String(150), nullable=False)
-    points = db.Column(db.Integer, default= 0)
-    streak = db.Column(db.Integer, default=0)
-    last_login = db.Column(db.Date, default=date.today)
-    last_target_date = db.Column(db.Date)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
-    journeys = db.relationship('Journey', backref='user', lazy=True, cascade="all, delete-orphan")
-
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
-
-class Target(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    completed = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    verification_required = db.Column(db.Boolean, default=False)
-    verification_status = db.Column(db.String(20), default='not_required')
-
-class Group(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), unique=True, nullable=False)
-    members = db.relationship('User', backref='group', lazy=True)
-    targets = db.relationship('GroupTarget', backref='group', lazy=True, cascade="all, delete-orphan")
-
-class GroupTarget(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
-    completed_by = db.relationship('User', secondary=group_target_completions, lazy='subquery', backref=db.backref('completed_group_targets', lazy=True))
-
-class Journey(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    title = db.Column(db.String(200), nullable=False)
-    original_goal = db.Column(db.Text, nullable=False)
-    active = db.Column(db.Boolean, default=True)
-    milestones = db.relationship('Milestone', backref='journey', lazy=True, cascade="all, delete-orphan")
-
-class Milestone(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    journey_id = db.Column(db.Integer, db.ForeignKey('journey.id'), nullable=False)
-    week = db.Column(db.Integer, nullable=False)
-    goal = db.Column(db.String(300), nullable=False)
-    daily_tasks = db.relationship('DailyTask', backref='milestone', lazy=True, cascade="all, delete-orphan")
-
-class DailyTask(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    milestone_id = db.Column(db.Integer, db.ForeignKey('milestone.id'), nullable=False)
-    task = db.Column(db.String(300), nullable=False)
-    completed = db.Column(db.Boolean, default=False)
-    target_id = db.Column(db.Integer, db.ForeignKey('target.id'))
-    target = db.relationship('Target', backref='daily_task', uselist=False)
-
-# --- THE FIX: Create database tables on startup ---
-with app.app_context():
-    db.create_all()
-# --- END OF FIX ---
+# Verification photos: hard cap on the upload, and the longest side sent to the vision model
+app.config['MAX_IMAGE_BYTES'] = int(os.environ.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+app.config['VISION_MAX_SIDE'] = int(os.environ.get('VISION_MAX_SIDE', 1024))
+# Batch verification: photos per form, photos per vision call, vision calls in flight per request
+app.config['VERIFY_BATCH_MAX'] = int(os.environ.get('VERIFY_BATCH_MAX', 8))
+app.config['VERIFY_BATCH_PER_CALL'] = int(os.environ.get('VERIFY_BATCH_PER_CALL', 4))
+app.config['VERIFY_BATCH_PARALLEL'] = int(os.environ.get('VERIFY_BATCH_PARALLEL', 2))
+# One photo plus form fields per request; only /verify_batch takes a form with several
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_IMAGE_BYTES'] + 64 * 1024
+app.config['VERIFY_BATCH_MAX_CONTENT_LENGTH'] = app.config['MAX_IMAGE_BYTES'] * app.config['VERIFY_BATCH_MAX'] + 64 * 1024
+# How many journeys are generated in parallel per worker process
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Stream plans from Gemini and show each week on the dashboard as soon as it arrives
+app.config['JOURNEY_STREAMING'] = os.environ.get('JOURNEY_STREAMING', '1') == '1'
+# An open /journey_stream response holds a worker thread, so it is capped well below gunicorn's
+# timeout (gunicorn.conf.py); the dashboard then opens a new stream
+app.config['JOURNEY_STREAM_SECONDS'] = int(os.environ.get('JOURNEY_STREAM_SECONDS', 25))
+app.config['JOURNEY_STREAM_POLL'] = float(os.environ.get('JOURNEY_STREAM_POLL', 0.5))
+# Which backend plans journeys and checks photos: gemini, local or replay (see ai_provider.py)
+app.config['AI_PROVIDER'] = os.environ.get('AI_PROVIDER', 'gemini')
+# 'local' = plan journeys with the local planner when the provider is overloaded, instead of retrying
+app.config['AI_PLAN_FALLBACK'] = os.environ.get('AI_PLAN_FALLBACK', '')
+app.config['AI_REPLAY_FILE'] = os.environ.get('AI_REPLAY_FILE', os.path.join(instance_dir, 'ai_responses.jsonl'))
+app.config['AI_RECORD_FILE'] = os.environ.get('AI_RECORD_FILE', '')
+# What the local planner says about photos: verified, rejected, or empty = can't check them
+app.config['AI_LOCAL_VERDICT'] = os.environ.get('AI_LOCAL_VERDICT', '')
+# Logged-in user snapshot per worker ('memory') or shared by every worker on the host ('sqlite:////path')
+app.config['USER_CACHE_ENABLED'] = os.environ.get('USER_CACHE_ENABLED', '1') == '1'
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+app.config['USER_CACHE_BACKEND'] = os.environ.get('USER_CACHE_BACKEND', 'memory')
+# Prometheus text on /metrics (optionally behind a bearer token) and a log line per slow request
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+# Daily streak/journey upkeep on the job queue, queued as gunicorn workers start; set to 0 when cron runs `flask --app app rollover run`
+app.config['ROLLOVER_ENABLED'] = os.environ.get('ROLLOVER_ENABLED', '1') == '1'
+app.config['ROLLOVER_ARCHIVE_DAYS'] = int(os.environ.get('ROLLOVER_ARCHIVE_DAYS', 30))
+# Compiled templates shared by every worker on the host; '' = each worker compiles its own
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(instance_dir, 'jinja_cache'))
+# Applied by each process on first use (startup.py); set to 0 when the deploy runs `flask --app app db upgrade` itself
+app.config['MIGRATE_ON_STARTUP'] = os.environ.get('MIGRATE_ON_STARTUP', '1') == '1'
+db.init_app(app)
+query_counter.init_app(app)
+job_queue = JobQueue(app)
+leaderboard_cache = Leaderboard(app)
+verification_cache = VerificationCache(app)
+plan_cache = PlanCache(app, prompt_version=gemini.JOURNEY_PROMPT_VERSION)
+ai = AIProviders(app)
+points_ledger = PointsLedger(app)
+group_pages = GroupPageCache(app)
+user_cache = UserCache(app)
+metrics = Metrics(app)
+rollover = DailyRollover(app)
+migrations = Migrations(app)
+# Schema and compiled templates on first use rather than at import (see startup.py)
+startup = Startup(app)
+
+def create_app():
+    # What gunicorn loads (gunicorn.conf.py). The routes are registered on the module-level
+    # app at import, so this readies that app rather than building another: the schema and
+    # every template up front, which a preloading master does once for all its workers.
+    with app.app_context():
+        startup.warm_templates()
+    return app
 
 # Login Manager, Helpers, and all Routes go here...
 # ... (This code is unchanged)
@@ -108,12 +132,7 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-group_target_completions = db.Table('group_target_completions',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key= True),
-    db.Column('group_target_id', db.Integer, db.ForeignKey('group_target.id'), primary_key=True)
-)
+    return user_cache.load(int(user_id))
 
 RANKS = [
     {"name": "Beginner", "points": 0, "badge": "🔰"}, 
@@ -130,8 +149,8 @@ def get_rank(points):
         else: break
     return current_rank
 
-@app.context_processor
-def inject_utilities(): return dict(get_rank=get_rank)
+# A global rather than a context processor so group_fragments.html macros can use it too
+app.add_template_global(get_rank)
 
 def allowed_file(filename): return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -148,15 +167,10 @@ def login():
             flash('Invalid username or password.', 'danger')
             return redirect(url_for('login'))
         
-        today = date.today()
-        if user.last_login < today:
-            user.points += 5
-            flash('Welcome back! +5 daily login points!', 'success')
-            if (today - user.last_login).days > 1: user.streak = 0
-            elif (today - user.last_login).days == 1:
-                user.streak+=1
-            user.last_login = today
+        if points_ledger.daily_login(user, 5, date.today()):
             db.session.commit()
+            flash('Welcome back! +5 daily login points!', 'success')
+            leaderboard_cache.points_changed(user)
             
         login_user(user)
         return redirect(url_for('dashboard'))
@@ -175,6 +189,7 @@ def register():
         new_user.set_password(password)
         db.session.add(new_user)
         db.session.commit()
+        leaderboard_cache.points_changed(new_user)
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -187,11 +202,15 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@query_budget(5)
 def dashboard():
-    active_journey = Journey.query.filter_by(user_id=current_user.id, active=True).first()
+    # Load the whole milestone -> task -> target tree up front (3 queries however long the plan is)
+    active_journey = Journey.query.filter_by(user_id=current_user.id, active=True).options(
+        selectinload(Journey.milestones).selectinload(Milestone.daily_tasks).joinedload(DailyTask.target)).first()
     current_rank = get_rank(current_user.points)
     next_rank = next((RANKS[i + 1] for i, rank in enumerate(RANKS) if rank == current_rank and i + 1 < len(RANKS)), None)
-    return render_template('dashboard.html', journey=active_journey, current_rank=current_rank, next_rank=next_rank)
+    pending_job = Job.query.filter(Job.user_id == current_user.id, Job.kind == 'build_journey', Job.status.in_(('queued', 'running'))).order_by(Job.id.desc()).first()
+    return render_template('dashboard.html', journey=active_journey, current_rank=current_rank, next_rank=next_rank, pending_job=pending_job)
 
 @app.route('/journey_builder')
 @login_required
@@ -206,83 +225,131 @@ def create_journey():
         flash('Please provide a goal.', 'danger')
         return redirect(url_for('journey_builder'))
 
-    Journey.query.filter_by(user_id=current_user.id).update({Journey.active: False})
-
-    prompt = f"""
-    You are an expert goal-setter and productivity coach. Your task is to take a user's high-level goal and break it down into a structured, step-by-step "Journey." The plan should be realistic, encouraging, and build momentum over time. The journey should be for 4 weeks if the duration is not mentioned in '{goal}'. Else you should provide the duration plan as mentioned in the'{goal}'
-
-    You must return your response as a single, valid JSON object. Do not include ```json markdown.
-    if duration is not of 4 weeks then change the JSON file accordingly(instead of week 1,week2 etc show something that is more appropriate)
-
-    The JSON object must have this exact structure:
-    {{
-      "journey_title": "Your Generated Title for the Journey",
-      "milestones": [
-        {{"week": 1, "weekly_goal": "A summary of the goal for this week", "daily_tasks": ["Task 1", "Task 2", "Task 3", "Task 4", "Task 5"]}},
-        {{"week": 2, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}},
-        {{"week": 3, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}},
-        {{"week": 4, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}}
-      ]
-    }}
+    # Someone already asked for (almost) the same goal - build it from the saved plan, no AI call needed
+    refresh = bool(request.form.get('refresh'))
+    journey_data = None if refresh else plan_cache.get(goal)
+    if journey_data is not None:
+        materialize_journey(current_user.id, goal, journey_data)
+        db.session.commit()
+        flash('Your new AI-powered journey has been created!', 'success')
+        return redirect(url_for('dashboard'))
 
-    User's Goal: "{goal}"
-    """
-    headers = {"Content-Type": "application/json"}
-    data = {"contents": [{"parts": [{"text": prompt}]}], "safetySettings": [ {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}, ]}
-    response = requests.post(GEMINI_API_URL, headers=headers, data=json.dumps(data))
+    # The Gemini call can take many seconds, so it runs on the job workers and the
+    # dashboard follows /journey_stream (or polls /journey_status) until it is ready.
+    job_queue.enqueue('build_journey', {'user_id': current_user.id, 'goal': goal, 'refresh': refresh}, user_id=current_user.id)
+    flash('Your AI journey is being built. It will appear here in a moment!', 'info')
+    return redirect(url_for('dashboard'))
 
-    if response.status_code == 200:
+@job_queue.handler('build_journey')
+def build_journey(payload, job):
+    user_id, goal = payload['user_id'], payload['goal']
+    journey_data = None if payload.get('refresh') else plan_cache.get(goal)
+    if journey_data is None:
+        if app.config['JOURNEY_STREAMING']:
+            return stream_journey(user_id, goal, job)
         try:
-            result_json = response.json()
-            if 'candidates' not in result_json or not result_json['candidates']:
-                flash('AI response was blocked or empty.', 'danger')
-                return redirect(url_for('journey_builder'))
-            
-            content_text = result_json['candidates'][0]['content']['parts'][0]['text']
-            
-            json_match = re.search(r'\{.*\}', content_text, re.DOTALL)
-            if not json_match:
-                flash(f'Could not find valid JSON in AI response.', 'danger')
-                return redirect(url_for('journey_builder'))
-            
-            journey_data = json.loads(json_match.group(0))
-
-            new_journey = Journey(user_id=current_user.id, title=journey_data['journey_title'], original_goal=goal)
-            db.session.add(new_journey)
-
-            verification_keywords = ['clean', 'organize', 'cook', 'build', 'draw', 'create', 'make']
-            for ms_data in journey_data['milestones']:
-                new_milestone = Milestone(journey=new_journey, week=ms_data['week'], goal=ms_data['weekly_goal'])
-                db.session.add(new_milestone)
-                for task_str in ms_data['daily_tasks']:
-                    new_task = DailyTask(milestone=new_milestone, task=task_str)
-                    if any(keyword in task_str.lower() for keyword in verification_keywords):
-                        verifiable_target = Target(title=task_str, user_id=current_user.id, verification_required=True, verification_status='pending')
-                        db.session.add(verifiable_target)
-                        new_task.target = verifiable_target
-                    db.session.add(new_task)
-            
+            journey_data = ai.generate_journey_plan(goal)
+        except AIUnavailable as e:
+            app.logger.warning('journey job %s: AI unavailable: %s', job.id, e)
+            raise RetryJob(AI_UNAVAILABLE_MESSAGE)
+        if 'planner' not in journey_data:
+            plan_cache.put(goal, journey_data)
+
+    return {'journey_id': materialize_journey(user_id, goal, journey_data)}
+
+def stream_journey(user_id, goal, job):
+    # Each milestone is committed as it streams in (the journey stays inactive
+    # until the plan is complete) so /journey_stream can show it straight away.
+    journey_id = None
+    try:
+        for kind, value in ai.stream_journey_plan(goal):
+            if kind == 'plan':
+                journey_data = value
+                continue
+            if journey_id is None:
+                journey_id = start_journey(user_id, goal, value if kind == 'title' else 'Your new journey')
+            if kind == 'milestone':
+                add_milestones(journey_id, user_id, [value])
+            job_queue.checkpoint(job, {'journey_id': journey_id})
+    except Exception as e:
+        db.session.rollback()
+        if journey_id is not None:
+            discard_journey(journey_id)
+            job.result = None
             db.session.commit()
-            flash('Your new AI-powered journey has been created!', 'success')
-            return redirect(url_for('dashboard'))
-        except Exception as e:
-            flash(f'Error processing AI response: {e}', 'danger')
-            return redirect(url_for('journey_builder'))
-    else:
-        flash(f'Failed to get a response from the AI. Error: {response.text}', 'danger')
-        return redirect(url_for('journey_builder'))
+        if isinstance(e, AIUnavailable):
+            app.logger.warning('journey job %s: AI unavailable: %s', job.id, e)
+            raise RetryJob(AI_UNAVAILABLE_MESSAGE)
+        raise
+
+    if 'planner' not in journey_data:
+        plan_cache.put(goal, journey_data)
+    if journey_id is None:
+        journey_id = start_journey(user_id, goal, journey_data['journey_title'])
+    activate_journey(user_id, journey_id, journey_data['journey_title'])
+    return {'journey_id': journey_id}
+
+@app.route('/journey_status/<int:job_id>')
+@login_required
+def journey_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return jsonify(job_queue.status(job))
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/journey_stream/<int:job_id>')
+@login_required
+def journey_stream(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+
+    # Server-sent events: one 'milestone' per week as the worker commits it, then 'done' or
+    # 'failed'. Reads the DB, so it works whichever process is running the job.
+    @stream_with_context
+    def events():
+        deadline = time.monotonic() + app.config['JOURNEY_STREAM_SECONDS']
+        journey_id, last_sent = None, 0
+        while True:
+            status = job_queue.status(db.session.get(Job, job_id))
+            current = (status['result'] or {}).get('journey_id')
+            if current != journey_id:
+                if last_sent:
+                    yield sse('reset', {})  # the build was retried from scratch
+                journey_id, last_sent = current, 0
+            if journey_id:
+                milestones = (Milestone.query.filter(Milestone.journey_id == journey_id, Milestone.id > last_sent)
+                              .options(selectinload(Milestone.daily_tasks)).order_by(Milestone.id).all())
+                for milestone in milestones:
+                    yield sse('milestone', {'week': milestone.week, 'goal': milestone.goal, 'tasks': [task.task for task in milestone.daily_tasks]})
+                    last_sent = milestone.id
+            if status['status'] in ('done', 'failed'):
+                yield sse(status['status'], status)
+                return
+            if time.monotonic() > deadline:
+                yield sse('timeout', {})
+                return
+            db.session.commit()  # end the read transaction so the next poll sees new rows
+            time.sleep(app.config['JOURNEY_STREAM_POLL'])
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/toggle_task/<int:task_id>', methods=['POST'])
 @login_required
 def toggle_task(task_id):
     task = DailyTask.query.get_or_404(task_id)
     if task.milestone.journey.user_id == current_user.id and not task.target:
-        if not task.completed:
-            task.completed = True
-            current_user.points += 10
-            flash('+10 points for completing the task well!', 'success')
+        # Conditional UPDATE: of two racing (or double-submitted) requests only one completes the task
+        completed = DailyTask.query.filter_by(id=task.id, completed=False).update({DailyTask.completed: True}, synchronize_session=False)
+        if completed and points_ledger.award(current_user.id, 10, 'task', f'task:{task.id}'):
             db.session.commit()
+            leaderboard_cache.points_changed(current_user)
+            flash('+10 points for completing the task well!', 'success')
         else:
+            db.session.rollback()
             flash('This task has already been completed.', 'info')
     return redirect(url_for('dashboard'))
 
@@ -296,6 +363,9 @@ def verify_target_page(target_id):
 @login_required
 def upload_verification(target_id):
     target = Target.query.get_or_404(target_id)
+    if target.completed:
+        flash('This task has already been verified.', 'info')
+        return redirect(url_for('dashboard'))
     if 'file' not in request.files:
         flash('No file part', 'danger')
         return redirect(request.url)
@@ -304,58 +374,158 @@ def upload_verification(target_id):
         flash('No selected file', 'danger')
         return redirect(request.url)
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        try:
+            image = images.ingest(file.stream, app.config['UPLOAD_FOLDER'], max_bytes=app.config['MAX_IMAGE_BYTES'], max_side=app.config['VISION_MAX_SIDE'])
+        except images.ImageError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('verify_target_page', target_id=target.id))
+
+        # Same (or nearly the same) photo seen before - no need to ask the AI again
+        cached = verification_cache.lookup(target, image.phash)
+        if cached is not None:
+            if cached.reused:
+                target.verification_status = 'rejected'
+                db.session.commit()
+                flash('This photo was already used to verify another task. Please upload a new photo.', 'warning')
+            else:
+                apply_verification(target, cached.verdict == 'verified')
+            return redirect(url_for('dashboard'))
 
-        with open(filepath, "rb") as image_file: image_bytes = image_file.read()
-        
-        prompt_text = f"""
-        You are a inspector. Your goal is to verify if a user has completed the task: '{target.title}'.
-        Analyze the provided image based on the following criteria:
-        1. Is it related to the task '{target.title}'
-        2. is the task completed as mentioned in '{target.title}'?
-        3. Is the document uploaded AI generated or it is really done by the user, respond as 'No' if it is AI generated.
-        After analyzing the image against these criteria, respond with only the word 'Yes' if the room is clean, or only the word 'No' if it is not.
-        """
-        
-        headers = {"Content-Type": "application/json"}
-        data = {"contents": [{"parts": [{"text": prompt_text}, {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(image_bytes).decode('utf-8')}}]}]}
+        try:
+            verified = ai.verify_photo(target.title, image.mime_type, image.base64())
+        except AIUnavailable as e:
+            app.logger.warning('photo check for target %s: AI unavailable: %s', target.id, e)
+            flash(AI_UNAVAILABLE_MESSAGE, 'danger')
+            return redirect(url_for('verify_target_page', target_id=target.id))
+        except Exception:
+            app.logger.exception('photo check for target %s failed', target.id)
+            flash('The AI could not check this photo. Please try again.', 'danger')
+            return redirect(url_for('verify_target_page', target_id=target.id))
+
+        verification_cache.store(target, image.phash, 'verified' if verified else 'rejected', user_id=current_user.id)
+        apply_verification(target, verified)
+        return redirect(url_for('dashboard'))
 
-        response = requests.post(GEMINI_VISION_API_URL, headers=headers, data=json.dumps(data))
-        
-        if response.status_code == 200:
-            try:
-                result_json = response.json()
-                ai_answer = result_json['candidates'][0]['content']['parts'][0]['text']
-                
-                if 'yes' in ai_answer.lower():
-                    target.verification_status = 'verified'
-                    target.completed = True
-                    daily_task = DailyTask.query.filter_by(target_id=target.id).first()
-                    if daily_task: daily_task.completed = True
-                    current_user.points += 25
-                    db.session.commit()
-                    flash('AI verification successful! +25 points!', 'success')
-                else:
-                    target.verification_status = 'rejected'
-                    db.session.commit()
-                    flash('AI verification rejected. Please try another photo.', 'warning')
-                return redirect(url_for('dashboard'))
-            except Exception as e:
-                flash(f'Error processing AI vision  response: {e}', 'danger')
-        else:
-            flash(f'Failed to get a response from the AI Vision API. Error: {response.text}', 'danger')
-        return redirect(url_for('verify_target_page', target_id=target.id))
-    
     flash('File type not allowed.', 'danger')
     return redirect(request.url)
 
+def record_verdict(target, verified):
+    # Applies one verdict in the current transaction; True when it earned the +25 points.
+    # Conditional UPDATEs, so a target that got verified meanwhile is left alone.
+    if not verified:
+        Target.query.filter_by(id=target.id, completed=False).update({Target.verification_status: 'rejected'}, synchronize_session=False)
+        return False
+    completed = Target.query.filter_by(id=target.id, completed=False).update(
+        {Target.completed: True, Target.verification_status: 'verified'}, synchronize_session=False)
+    if not completed:
+        return False
+    DailyTask.query.filter_by(target_id=target.id).update({DailyTask.completed: True}, synchronize_session=False)
+    return points_ledger.award(current_user.id, 25, 'verification', f'verification:{target.id}')
+
+def apply_verification(target, verified):
+    awarded = record_verdict(target, verified)
+    db.session.commit()
+    if awarded:
+        leaderboard_cache.points_changed(current_user)
+        flash('AI verification successful! +25 points!', 'success')
+    elif verified:
+        flash('This task has already been verified.', 'info')
+    else:
+        flash('AI verification rejected. Please try another photo.', 'warning')
+
+def pending_verifications(user_id):
+    # Photo-verified targets in the user's active journey that are still open
+    return (Target.query.join(DailyTask, DailyTask.target_id == Target.id).join(Milestone).join(Journey)
+            .filter(Journey.user_id == user_id, Journey.active == True, Target.verification_required == True, Target.completed == False)
+            .order_by(Milestone.week, DailyTask.id).limit(app.config['VERIFY_BATCH_MAX']).all())
+
+@app.route('/verify_batch')
+@login_required
+def verify_batch_page():
+    return render_template('verify_batch.html', targets=pending_verifications(current_user.id))
+
+@app.route('/verify_batch', methods=['POST'])
+@login_required
+def verify_batch():
+    # One photo per pending target (form field file_<target id>); cached verdicts first,
+    # the rest in as few vision calls as VERIFY_BATCH_PER_CALL allows, all applied in one commit
+    targets = {target.id: target for target in pending_verifications(current_user.id)}
+    uploads = []
+    for field, file in request.files.items(multi=True):
+        target_id = field.removeprefix('file_')
+        target = targets.get(int(target_id)) if target_id.isdigit() else None
+        if target is None or not file.filename:
+            continue
+        if not allowed_file(file.filename):
+            flash(f'"{target.title}": file type not allowed.', 'danger')
+            continue
+        try:
+            image = images.ingest(file.stream, app.config['UPLOAD_FOLDER'], max_bytes=app.config['MAX_IMAGE_BYTES'], max_side=app.config['VISION_MAX_SIDE'])
+        except images.ImageError as e:
+            flash(f'"{target.title}": {e}', 'danger')
+            continue
+        uploads.append((target, image))
+    if not uploads:
+        flash('Choose at least one photo to verify.', 'warning')
+        return redirect(url_for('verify_batch_page'))
+
+    verdicts, reused, to_ask, earlier = {}, [], [], []
+    threshold = app.config['VERIFICATION_CACHE_THRESHOLD']
+    for target, image in uploads:
+        # The cache only knows stored verdicts, so one photo sent for several tasks in this
+        # batch is caught here: only its first task gets a verdict
+        if any(images.hamming(image.phash, phash) <= threshold for phash in earlier):
+            reused.append(target)
+            continue
+        earlier.append(image.phash)
+        cached = verification_cache.lookup(target, image.phash)
+        if cached is None:
+            to_ask.append((target, image))
+        elif cached.reused:
+            reused.append(target)
+        else:
+            verdicts[target.id] = cached.verdict == 'verified'
+    answers = ai.verify_photo_batches([(target.title, image.mime_type, image.base64()) for target, image in to_ask],
+                                          per_call=app.config['VERIFY_BATCH_PER_CALL'], parallel=app.config['VERIFY_BATCH_PARALLEL'])
+    for (target, image), verified in zip(to_ask, answers):
+        if verified is not None:
+            verification_cache.store(target, image.phash, 'verified' if verified else 'rejected', user_id=current_user.id)
+            verdicts[target.id] = verified
+
+    awarded = rejected = 0
+    for target, _ in uploads:
+        if target in reused:
+            Target.query.filter_by(id=target.id, completed=False).update({Target.verification_status: 'rejected'}, synchronize_session=False)
+        elif target.id in verdicts:
+            awarded += record_verdict(target, verdicts[target.id])
+            rejected += not verdicts[target.id]
+    db.session.commit()
+    if awarded:
+        leaderboard_cache.points_changed(current_user)
+        flash(f'AI verified {awarded} task(s)! +{25 * awarded} points!', 'success')
+    if rejected:
+        flash(f'AI verification rejected {rejected} photo(s). Please try other photos.', 'warning')
+    if reused:
+        flash(f'{len(reused)} photo(s) were already used to verify another task. Please upload new photos.', 'warning')
+    unanswered = len(uploads) - len(verdicts) - len(reused)
+    if unanswered:
+        flash(f'The AI could not check {unanswered} photo(s) right now. Please try them again.', 'danger')
+    return redirect(url_for('dashboard'))
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit = app.config['MAX_IMAGE_BYTES'] // (1024 * 1024)
+    if request.endpoint in UPLOAD_LIMITS:
+        flash(f'Those photos are too large (limit is {limit} MB per photo, {app.config["VERIFY_BATCH_MAX"]} photos at a time).', 'danger')
+    else:
+        flash(f'That photo is too large (limit is {limit} MB).', 'danger')
+    return redirect(request.referrer or url_for('dashboard'))
+
 @app.route('/groups')
 @login_required
+@query_budget(3)
 def groups():
-    all_groups = Group.query.all()
-    return render_template('groups.html', groups=all_groups)
+    return render_template('groups.html', groups=group_cache.member_counts())
 
 @app.route('/create_group', methods=['POST'])
 @login_required
@@ -366,8 +536,10 @@ def create_group():
             flash('A group with this name already exists.', 'danger')
         else:
             new_group = Group(name=group_name)
-            new_group.members.append(current_user)
             db.session.add(new_group)
+            db.session.flush()
+            group_cache.bump(current_user.group_id)
+            current_user.group_id = new_group.id
             db.session.commit()
             flash('Group created successfully!', 'success')
     return redirect(url_for('groups'))
@@ -377,7 +549,8 @@ def create_group():
 def join_group(group_id):
     group = Group.query.get(group_id)
     if group and not current_user.group:
-        group.members.append(current_user)
+        current_user.group_id = group.id
+        group_cache.bump(group.id)
         db.session.commit()
         flash(f'Successfully joined {group.name}!', 'success')
     elif current_user.group:
@@ -389,18 +562,22 @@ def join_group(group_id):
 def leave_group():
     if current_user.group:
         flash(f'You have left {current_user.group.name}.', 'info')
+        group_cache.bump(current_user.group_id)
         current_user.group_id = None
         db.session.commit()
     return redirect(url_for('groups'))
 
 @app.route('/group/<int:group_id>')
 @login_required
+@query_budget(7)
 def group_page(group_id):
     group = Group.query.get_or_404(group_id)
     if current_user.group_id != group_id:
         flash('You are not a member of this group.', 'danger')
         return redirect(url_for('groups'))
-    return render_template('group_page.html', group=group)
+    fragments = group_pages.fragments(group)
+    targets = group_pages.render_targets(fragments, group_cache.completed_by(current_user.id, group.id))
+    return render_template('group_page.html', group=group, targets=targets, members=fragments.members)
 
 @app.route('/add_group_target/<int:group_id>', methods=['POST'])
 @login_required
@@ -410,6 +587,7 @@ def add_group_target(group_id):
         if title:
             new_target = GroupTarget(title=title, group_id=group_id)
             db.session.add(new_target)
+            group_cache.bump(group_id)
             db.session.commit()
             flash('New group target added!', 'success')
     return redirect(url_for('group_page', group_id=group_id))
@@ -418,18 +596,38 @@ def add_group_target(group_id):
 @login_required
 def complete_group_target(target_id):
     target = GroupTarget.query.get_or_404(target_id)
-    if current_user.group_id == target.group_id and current_user not in target.completed_by:
-        target.completed_by.append(current_user)
-        current_user.points += 20
-        db.session.commit()
-        flash('You completed a group target of yours! +20 points!', 'success')
+    if current_user.group_id == target.group_id:
+        completed = db.session.execute(insert_ignore(group_target_completions).values(user_id=current_user.id, group_target_id=target.id)).rowcount
+        if completed and points_ledger.award(current_user.id, 20, 'group_target', f'group_target:{target.id}:{current_user.id}'):
+            group_cache.bump(target.group_id)
+            db.session.commit()
+            leaderboard_cache.points_changed(current_user)
+            flash('You completed a group target of yours! +20 points!', 'success')
+        else:
+            db.session.rollback()
     return redirect(url_for('group_page', group_id=target.group_id))
 
 @app.route('/leaderboard')
 @login_required
 def leaderboard():
-    all_users = User.query.order_by(User.points.desc()).all()
-    return render_template('leaderboard.html', users=all_users)
+    page = request.args.get('page', 1, type=int)
+    entries, has_next = leaderboard_cache.page(page)
+    # Show where the user stands when they are not on this page
+    around_me = None if any(entry.id == current_user.id for entry in entries) else leaderboard_cache.around(current_user)
+    return render_template('leaderboard.html', entries=entries, page=page, has_next=has_next, around_me=around_me,
+                           title='Leaderboard', subtitle="See who's at the top of their game this week.", page_endpoint='leaderboard', page_args={})
+
+@app.route('/group/<int:group_id>/leaderboard')
+@login_required
+def group_leaderboard(group_id):
+    group = Group.query.get_or_404(group_id)
+    if current_user.group_id != group_id:
+        flash('You are not a member of this group.', 'danger')
+        return redirect(url_for('groups'))
+    page = request.args.get('page', 1, type=int)
+    entries, has_next = leaderboard_cache.group_page(group.id, page)
+    return render_template('leaderboard.html', entries=entries, page=page, has_next=has_next, around_me=None,
+                           title=f'{group.name} Leaderboard', subtitle='How your group stacks up.', page_endpoint='group_leaderboard', page_args={'group_id': group.id})
 
 
 
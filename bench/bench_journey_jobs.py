@@ -0,0 +1,106 @@
+# BENCHMARK - many simultaneous journey builds through the background job queue
+#
+# Starts the stub Gemini server and the app (threaded werkzeug server, fresh
+# SQLite file), logs in N users and fires N concurrent POST /create_journey.
+# Reports how fast the route answers (requests/sec, latency) and how long the
+# job workers take to turn every request into a journey.
+#
+#   python bench/bench_journey_jobs.py --users 50 --latency 2.0 --workers 8
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import statistics
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import start_stub, stub_base
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=2.0, help='stub Gemini latency in seconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=8, help='JOB_WORKERS for the app')
+    args = parser.parse_args()
+
+    stub = start_stub(latency=args.latency, fail_rate=args.fail_rate)
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+    os.environ['GEMINI_API_BASE'] = stub_base(stub)
+    os.environ['GEMINI_MAX_CONCURRENCY'] = str(args.workers)
+    # A stub failing on purpose shouldn't trip the circuit breaker
+    os.environ.setdefault('GEMINI_BREAKER_FAILURES', str(args.users))
+    os.environ['JOB_WORKERS'] = str(args.workers)
+    import app as webapp
+    from models import db, User, Job, Journey
+    from werkzeug.serving import make_server
+    webapp.app.config['JOB_RETRY_BACKOFF'] = 0.2
+
+    with webapp.app.app_context():
+        for i in range(args.users):
+            user = User(username=f'bench{i}')
+            user.set_password('pw')
+            db.session.add(user)
+        db.session.commit()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    sessions = []
+    for i in range(args.users):
+        s = requests.Session()
+        s.post(f'{base}/login', data={'username': f'bench{i}', 'password': 'pw'}, allow_redirects=False)
+        sessions.append(s)
+
+    latencies, barrier = [], threading.Barrier(args.users)
+
+    def build(s, i):
+        barrier.wait()
+        t0 = time.perf_counter()
+        r = s.post(f'{base}/create_journey', data={'goal': f'learn skill {i} in 4 weeks'}, allow_redirects=False)
+        latencies.append(time.perf_counter() - t0)
+        assert r.status_code == 302, r.status_code
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=build, args=(s, i)) for i, s in enumerate(sessions)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    enqueue_time = time.perf_counter() - t0
+
+    with webapp.app.app_context():
+        # Only the journey builds: other jobs (the daily rollover) stay queued for later
+        job_ids = [job_id for (job_id,) in db.session.query(Job.id).filter_by(kind='build_journey').all()]
+        finished = webapp.job_queue.wait(job_ids, timeout=args.users * (args.latency + 1) * 4)
+        total_time = time.perf_counter() - t0
+        done = Job.query.filter_by(kind='build_journey', status='done').count()
+        failed = Job.query.filter_by(kind='build_journey', status='failed').count()
+        journeys = Journey.query.count()
+
+    print(f'users / concurrent builds : {args.users}')
+    print(f'stub Gemini latency        : {args.latency:.2f}s (a blocking route would take at least this long)')
+    print(f'create_journey req/sec     : {args.users / enqueue_time:.1f}')
+    print(f'create_journey p50 / p95   : {statistics.median(latencies) * 1000:.1f} ms / {percentile(latencies, 95) * 1000:.1f} ms')
+    print(f'all journeys built in      : {total_time:.2f}s ({journeys / total_time:.2f} journeys/sec, {args.workers} workers)')
+    print(f'jobs done / failed         : {done} / {failed}  (stub calls: {stub.calls}, finished: {finished})')
+
+    webapp.job_queue.stop()
+    server.shutdown()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# BENCHMARK - time until the first week of a new journey is on screen
+#
+# Starts the stub Gemini server (chunked streamGenerateContent responses) and the
+# app, creates a journey and follows /journey_stream like the dashboard does.
+# Runs once with JOURNEY_STREAMING on and once with it off, and reports when the
+# first milestone event and the final 'done' event arrived after the POST.
+#
+#   python bench/bench_journey_stream.py --latency 6.0 --weeks 12
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import start_stub, stub_base
+
+
+def follow(webapp, session, base, goal):
+    # Returns (seconds to first milestone, seconds to done, milestones seen, last event)
+    from models import Job
+    t0 = time.perf_counter()
+    session.post(f'{base}/create_journey', data={'goal': goal}, allow_redirects=False)
+    with webapp.app.app_context():
+        job_id = Job.query.order_by(Job.id.desc()).first().id
+    first, seen, event = None, 0, None
+    with session.get(f'{base}/journey_stream/{job_id}', stream=True) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+                if event == 'milestone':
+                    seen += 1
+                    first = first or time.perf_counter() - t0
+                elif event in ('done', 'failed', 'timeout'):
+                    break
+    return first, time.perf_counter() - t0, seen, event
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=6.0, help='total stub Gemini generation time in seconds')
+    parser.add_argument('--weeks', type=int, default=12)
+    parser.add_argument('--chunks', type=int, default=24, help='SSE chunks the stub splits the plan into')
+    args = parser.parse_args()
+
+    stub = start_stub(latency=args.latency, weeks=args.weeks, stream_chunks=args.chunks)
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+    os.environ['GEMINI_API_BASE'] = stub_base(stub)
+    os.environ['JOURNEY_STREAM_POLL'] = '0.1'
+    import app as webapp
+    from models import db, User
+    from werkzeug.serving import make_server
+
+    with webapp.app.app_context():
+        user = User(username='bench')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    session = requests.Session()
+    session.post(f'{base}/login', data={'username': 'bench', 'password': 'pw'}, allow_redirects=False)
+
+    print(f'stub Gemini: {args.weeks}-week plan over {args.latency:.1f}s in {args.chunks} chunks')
+    for i, streaming in enumerate((True, False)):
+        webapp.app.config['JOURNEY_STREAMING'] = streaming
+        first, total, seen, event = follow(webapp, session, base, f'learn skill {i} in {args.weeks} weeks')
+        first = f'{first:.2f}s' if first is not None else '-'
+        print(f"{'streaming' if streaming else 'blocking ':9} : first week after {first:>6}, journey ready after {total:.2f}s "
+              f'({seen} milestone events, ended with {event!r})')
+
+    webapp.job_queue.stop()
+    server.shutdown()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# BENCHMARK - per-object ORM inserts vs. materialize.py bulk inserts
+#
+# Writes the same 4-, 12- and 52-week plans both ways and reports wall time
+# and the number of SQL statements sent. Uses a fresh SQLite file by default;
+# pass --database-url to run against PostgreSQL.
+#
+#   python bench/bench_materialize.py --repeat 20
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import journey_plan
+
+
+def materialize_per_object(user_id, goal, journey_data):
+    # The original create_journey loop, kept here as the baseline
+    from models import db, Journey, Milestone, DailyTask, Target
+    from materialize import needs_verification
+    Journey.query.filter_by(user_id=user_id).update({Journey.active: False})
+    new_journey = Journey(user_id=user_id, title=journey_data['journey_title'], original_goal=goal)
+    db.session.add(new_journey)
+    for ms_data in journey_data['milestones']:
+        new_milestone = Milestone(journey=new_journey, week=ms_data['week'], goal=ms_data['weekly_goal'])
+        db.session.add(new_milestone)
+        for task_str in ms_data['daily_tasks']:
+            new_task = DailyTask(milestone=new_milestone, task=task_str)
+            if needs_verification(task_str):
+                verifiable_target = Target(title=task_str, user_id=user_id, verification_required=True, verification_status='pending')
+                db.session.add(verifiable_target)
+                new_task.target = verifiable_target
+            db.session.add(new_task)
+    db.session.flush()
+    return new_journey.id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--tasks-per-week', type=int, default=7)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.sqlite')}"
+    import app as webapp
+    from models import db, User
+    from materialize import materialize_journey, needs_verification
+    from sqlalchemy import event
+
+    statements = [0]
+    with webapp.app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *a: statements.__setitem__(0, statements[0] + 1))
+        user = User(username=f'bench-materialize-{time.time()}')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        print(f"{'weeks':>5} {'rows':>6} | {'per-object ms':>13} {'stmts':>6} | {'bulk ms':>8} {'stmts':>6} | speedup")
+        for weeks in (4, 12, 52):
+            plan = journey_plan(weeks, args.tasks_per_week)
+            rows = 1 + weeks + weeks * args.tasks_per_week + sum(needs_verification(t) for ms in plan['milestones'] for t in ms['daily_tasks'])
+            results = {}
+            for name, func in (('per-object', materialize_per_object), ('bulk', materialize_journey)):
+                timings = []
+                for _ in range(args.repeat):
+                    statements[0] = 0
+                    t0 = time.perf_counter()
+                    func(user_id, 'bench goal', plan)
+                    db.session.commit()
+                    timings.append(time.perf_counter() - t0)
+                results[name] = (statistics.median(timings) * 1000, statements[0])
+            (slow, slow_stmts), (fast, fast_stmts) = results['per-object'], results['bulk']
+            print(f'{weeks:>5} {rows:>6} | {slow:>13.2f} {slow_stmts:>6} | {fast:>8.2f} {fast_stmts:>6} | {slow / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
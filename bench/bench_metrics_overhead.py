@@ -0,0 +1,69 @@
+# BENCHMARK - what the metrics layer costs per request
+#
+# Renders /dashboard and /groups --requests times each through the test client
+# (no network, so the instrumentation is a visible share of the time) with
+# metrics off, with METRICS_ENABLED on, and with the slow-request log on as
+# well. Each mode runs in its own process because the hooks are installed (or
+# not) at startup.
+#
+#   python bench/bench_metrics_overhead.py --requests 2000
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODES = {'off': {}, 'metrics': {'METRICS_ENABLED': '1'}, 'metrics+slow log': {'METRICS_ENABLED': '1', 'SLOW_REQUEST_SECONDS': '10'}}
+
+
+def run(requests):
+    import app as webapp
+    from models import db, User
+    from materialize import materialize_journey
+    from stub_gemini import journey_plan
+    with webapp.app.app_context():
+        user = User(username='bench')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.flush()
+        materialize_journey(user.id, 'bench', journey_plan(4, 5))
+        db.session.commit()
+    client = webapp.app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'pw'})
+    results = {}
+    for path in ('/dashboard', '/groups'):
+        for _ in range(50):
+            client.get(path)
+        t0 = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        results[path] = (time.perf_counter() - t0) / requests
+    webapp.job_queue.stop()
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run(args.requests)
+
+    baseline = None
+    for mode, env in MODES.items():
+        env = dict(os.environ, **env, DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'metrics.sqlite')}")
+        out = subprocess.run([sys.executable, __file__, '--child', '--requests', str(args.requests)],
+                             env=env, check=True, capture_output=True, text=True).stdout
+        results = json.loads(out.strip().splitlines()[-1])
+        baseline = baseline or results
+        row = ', '.join(f'{path} {seconds * 1000:.3f} ms ({(seconds / baseline[path] - 1) * 100:+.1f}%)' for path, seconds in results.items())
+        print(f'{mode:<17}: {row}')
+
+
+if __name__ == '__main__':
+    main()
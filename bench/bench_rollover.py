@@ -0,0 +1,107 @@
+# BENCHMARK - the daily rollover on a big database, and a check of what it did
+#
+# Seeds --users users whose last login is spread over the past --spread days
+# (streaks 0-60) and gives each user an active journey plus --old-journeys
+# replaced ones. All were created long ago; half were replaced more than
+# ROLLOVER_ARCHIVE_DAYS ago, the other half two days ago. Then runs the
+# rollover for today and checks:
+#   - nobody who missed yesterday still has a streak, everybody else kept theirs
+#   - exactly the old replaced journeys were archived, with all their tasks
+#   - the active journeys' tasks were not touched
+#   - a second run the same day does nothing
+#
+#   python bench/bench_rollover.py --users 20000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--old-journeys', type=int, default=2, help='replaced journeys per user')
+    parser.add_argument('--weeks', type=int, default=2)
+    parser.add_argument('--tasks', type=int, default=5, help='tasks per week')
+    parser.add_argument('--spread', type=int, default=10, help='last logins are spread over this many days')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rollover.sqlite')}"
+    os.environ['ROLLOVER_ENABLED'] = '0'
+    import app as webapp
+    from sqlalchemy import insert, func, select
+    from models import db, User, Journey, Milestone, DailyTask, DailyTaskArchive
+    webapp.app.config['ROLLOVER_BATCH_SIZE'] = args.batch_size
+
+    rnd = random.Random(1)
+    today = date.today()
+    now = datetime.utcnow()
+    archive_days = webapp.app.config['ROLLOVER_ARCHIVE_DAYS']
+    journeys_per_user = args.old_journeys + 1
+    t0 = time.perf_counter()
+    with webapp.app.app_context():
+        db.session.execute(insert(User), [{'username': f'user{u}', 'password_hash': 'x', 'points': 0, 'streak': rnd.randint(0, 60),
+                                           'last_login': today - timedelta(days=rnd.randrange(args.spread))} for u in range(args.users)])
+        # Journey j of each user: the last one active, the replaced ones alternately replaced long ago and recently
+        db.session.execute(insert(Journey), [{'user_id': u, 'title': 'j', 'original_goal': 'g', 'active': j == args.old_journeys,
+                                              'created_at': now - timedelta(days=archive_days + 30),
+                                              'replaced_at': None if j == args.old_journeys else now - timedelta(days=archive_days + 5 if j % 2 == 0 else 2)}
+                                             for u in range(1, args.users + 1) for j in range(journeys_per_user)])
+        journeys = args.users * journeys_per_user
+        db.session.execute(insert(Milestone), [{'journey_id': j, 'week': w, 'goal': 'goal'}
+                                               for j in range(1, journeys + 1) for w in range(1, args.weeks + 1)])
+        db.session.execute(insert(DailyTask.__table__), [{'milestone_id': m, 'task': 'task', 'completed': False}
+                                                         for m in range(1, journeys * args.weeks + 1) for _ in range(args.tasks)])
+        db.session.commit()
+        before = {
+            'missed': db.session.scalar(select(func.count()).where(User.last_login < today - timedelta(days=1), User.streak != 0)),
+            'kept': dict(db.session.execute(select(User.id, User.streak).where(User.last_login >= today - timedelta(days=1))).all()),
+            'active_tasks': db.session.scalar(select(func.count()).select_from(DailyTask).join(Milestone).join(Journey).where(Journey.active == True)),
+            'old_journeys': db.session.scalar(select(func.count()).where(Journey.active == False, Journey.replaced_at < now - timedelta(days=archive_days))),
+        }
+        tasks_total = db.session.scalar(select(func.count()).select_from(DailyTask))
+    print(f'seeded {args.users} users, {journeys} journeys, {tasks_total} tasks in {time.perf_counter() - t0:.1f}s')
+
+    with webapp.app.app_context():
+        t0 = time.perf_counter()
+        counts = webapp.rollover.run(today)
+        elapsed = time.perf_counter() - t0
+        print(f'rollover: {counts} in {elapsed:.2f}s')
+        again = webapp.rollover.run(today)
+
+        failures = []
+        if counts['streaks_reset'] != before['missed']:
+            failures.append(f"reset {counts['streaks_reset']} streaks, expected {before['missed']}")
+        if db.session.scalar(select(func.count()).where(User.last_login < today - timedelta(days=1), User.streak != 0)):
+            failures.append('users who missed yesterday still have a streak')
+        if dict(db.session.execute(select(User.id, User.streak).where(User.last_login >= today - timedelta(days=1))).all()) != before['kept']:
+            failures.append('streaks of users who logged in yesterday or today changed')
+        if counts['journeys_archived'] != before['old_journeys']:
+            failures.append(f"archived {counts['journeys_archived']} journeys, expected {before['old_journeys']}")
+        expected_tasks = before['old_journeys'] * args.weeks * args.tasks
+        if counts['tasks_archived'] != expected_tasks or db.session.scalar(select(func.count()).select_from(DailyTaskArchive)) != expected_tasks:
+            failures.append(f"archived {counts['tasks_archived']} tasks, expected {expected_tasks}")
+        if db.session.scalar(select(func.count()).select_from(DailyTask).join(Milestone).join(Journey).where(Journey.active == True)) != before['active_tasks']:
+            failures.append('tasks of active journeys were touched')
+        if again is not None:
+            failures.append(f'a second run on the same day did something: {again}')
+    webapp.job_queue.stop()
+
+    rows = counts['streaks_reset'] + counts['tasks_archived']
+    print(f'{args.users / elapsed:,.0f} users/s, {rows / elapsed:,.0f} changed rows/s; daily_task went from {tasks_total} to {tasks_total - counts["tasks_archived"]} rows')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# BENCHMARK - time to first response of a freshly started worker
+#
+# Starts --workers workers at once, the way gunicorn boots them, and times each
+# one from its start to its first /login page and to its first /dashboard after
+# logging in (the two biggest templates). Three ways of starting:
+#
+#   import, no template cache   every worker imports app.py and compiles its templates
+#   import, bytecode cache      same, with TEMPLATE_CACHE_DIR filled by an earlier process
+#   preload + fork              create_app() in a master, workers forked from it
+#                               (what gunicorn.conf.py sets up; the master's one-off
+#                               boot is shown separately)
+#
+# The workers run in separate processes and serve through the test client, so
+# the numbers are boot and first-render costs, not network. The database
+# is migrated and seeded beforehand, as it would be on a redeploy. The rollover
+# scheduler is off so no worker starts job threads during the measurement.
+#
+#   python bench/bench_startup.py --workers 4 --rounds 3
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def first_responses(webapp, started):
+    client = webapp.app.test_client()
+    times = {'imported': time.time() - started}
+    assert client.get('/login').status_code == 200
+    times['login'] = time.time() - started
+    # Straight into the session: the password check would cost more than the rest of the request
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    assert client.get('/dashboard').status_code == 200
+    times['dashboard'] = time.time() - started
+    return times
+
+
+def seed():
+    import app as webapp
+    from models import db, User
+    from materialize import materialize_journey
+    from stub_gemini import journey_plan
+    with webapp.app.app_context():
+        user = User(username='bench')
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.flush()
+        materialize_journey(user.id, 'bench', journey_plan(4, 5))
+        db.session.commit()
+        webapp.startup.warm_templates()
+
+
+def worker(started):
+    import app as webapp
+    print(json.dumps(first_responses(webapp, started)))
+
+
+def master(workers):
+    t0 = time.perf_counter()
+    import app as webapp
+    webapp.create_app()
+    boot = time.perf_counter() - t0
+    results = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        started = time.time()
+        if os.fork() == 0:
+            os.close(read)
+            # What gunicorn.conf.py's post_fork does
+            with webapp.app.app_context():
+                for engine in webapp.db.engines.values():
+                    engine.dispose(close=False)
+            os.write(write, json.dumps(first_responses(webapp, started)).encode())
+            os._exit(0)
+        os.close(write)
+        results.append(read)
+    out = []
+    for read in results:
+        with os.fdopen(read) as f:
+            out.append(json.loads(f.read()))
+        os.wait()
+    print(json.dumps({'boot': boot, 'workers': out}))
+
+
+def run_mode(mode, workers, env):
+    if mode == 'preload + fork':
+        out = subprocess.run([sys.executable, __file__, '--master', '--workers', str(workers)],
+                             env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        return result['workers'], result['boot']
+    procs = [subprocess.Popen([sys.executable, __file__, '--worker', repr(time.time())], env=env, stdout=subprocess.PIPE, text=True)
+             for _ in range(workers)]
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode:
+            raise SystemExit(f'worker failed ({mode})')
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--worker', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--master', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.seed:
+        return seed()
+    if args.worker is not None:
+        return worker(args.worker)
+    if args.master:
+        return master(args.workers)
+
+    tmp = tempfile.mkdtemp()
+    cache_dir = os.path.join(tmp, 'jinja_cache')
+    base = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.sqlite')}", ROLLOVER_ENABLED='0')
+    subprocess.run([sys.executable, __file__, '--seed'], env=dict(base, TEMPLATE_CACHE_DIR=cache_dir), check=True)
+    modes = {
+        'import, no template cache': dict(base, TEMPLATE_CACHE_DIR=''),
+        'import, bytecode cache': dict(base, TEMPLATE_CACHE_DIR=cache_dir),
+        'preload + fork': dict(base, TEMPLATE_CACHE_DIR=cache_dir),
+    }
+    print(f'{args.workers} workers, median of {args.rounds} rounds; seconds from worker start to first response')
+    for mode, env in modes.items():
+        rounds = [run_mode(mode, args.workers, env) for _ in range(args.rounds)]
+        row = []
+        for page in ('login', 'dashboard'):
+            mean = statistics.median(statistics.mean(w[page] for w in workers) for workers, _ in rounds)
+            slowest = statistics.median(max(w[page] for w in workers) for workers, _ in rounds)
+            row.append(f'/{page} {mean * 1000:5.0f} ms (slowest {slowest * 1000:4.0f})')
+        # Just the two first requests, without the import before them
+        requests = statistics.median(statistics.mean(w['dashboard'] - w['imported'] for w in workers) for workers, _ in rounds)
+        row.append(f'requests alone {requests * 1000:4.0f} ms')
+        boot = rounds[0][1] is not None and f'; master boot {statistics.median(b for _, b in rounds) * 1000:.0f} ms once' or ''
+        print(f'{mode:<26}: {", ".join(row)}{boot}')
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# BENCHMARK - photo verification one task at a time vs. the batch endpoint
+#
+# Starts the stub Gemini server and the app (threaded werkzeug server, fresh
+# SQLite file). Every user has a journey with --photos tasks that need photo
+# verification and a distinct random photo for each. Half the users verify
+# them one by one through /upload_verification, the other half send them all
+# in one POST /verify_batch. All users of a flow run concurrently. Reports wall
+# time, photos verified per second, vision calls made and the points awarded.
+# A third flow sends one photo for all of a user's tasks in one batch; only the
+# first task may be verified, the rest must be rejected as reused.
+#
+#   python bench/bench_verify_batch.py --users 8 --photos 6 --latency 1.5 --image-latency 0.1
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import start_stub, stub_base
+
+
+def random_photo(seed):
+    rnd = random.Random(seed)
+    img = Image.new('RGB', (8, 8))
+    img.putdata([(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for _ in range(64)])
+    buffer = io.BytesIO()
+    img.resize((320, 240), Image.NEAREST).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=8, help='users per flow')
+    parser.add_argument('--photos', type=int, default=6, help='pending verifications per user')
+    parser.add_argument('--latency', type=float, default=1.5, help='stub Gemini latency per call in seconds')
+    parser.add_argument('--image-latency', type=float, default=0.1, help='extra stub latency per photo in a call')
+    args = parser.parse_args()
+
+    stub = start_stub(latency=args.latency, image_latency=args.image_latency)
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+    os.environ['GEMINI_API_BASE'] = stub_base(stub)
+    os.environ['GEMINI_MAX_CONCURRENCY'] = str(args.users * args.photos)
+    os.environ['VERIFY_BATCH_MAX'] = str(args.photos)
+    import app as webapp
+    from models import db, User, Target
+    from materialize import materialize_journey
+    from werkzeug.serving import make_server
+    webapp.app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+
+    plan = {'journey_title': 'Verification bench', 'milestones': [
+        {'week': 1, 'weekly_goal': 'Tidy up', 'daily_tasks': [f'Clean area {i}' for i in range(args.photos)]}]}
+    with webapp.app.app_context():
+        for flow in ('single', 'batch', 'dup'):
+            for i in range(args.users):
+                user = User(username=f'{flow}{i}')
+                user.set_password('pw')
+                db.session.add(user)
+                db.session.flush()
+                materialize_journey(user.id, 'tidy up', plan)
+        db.session.commit()
+        targets = {username: ids for username, ids in (
+            (user.username, [t.id for t in Target.query.filter_by(user_id=user.id).order_by(Target.id)]) for user in User.query.all())}
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    def single(s, username):
+        for n, target_id in enumerate(targets[username]):
+            s.post(f'{base}/upload_verification/{target_id}', files={'file': ('photo.jpg', random_photo(f'{username}/{n}'), 'image/jpeg')},
+                   allow_redirects=False)
+
+    def batch(s, username):
+        files = {f'file_{target_id}': ('photo.jpg', random_photo(f'{username}/{n}'), 'image/jpeg') for n, target_id in enumerate(targets[username])}
+        s.post(f'{base}/verify_batch', files=files, allow_redirects=False)
+
+    def dup(s, username):
+        photo = random_photo(username)
+        s.post(f'{base}/verify_batch', files={f'file_{target_id}': ('photo.jpg', photo, 'image/jpeg') for target_id in targets[username]},
+               allow_redirects=False)
+
+    print(f'{args.users} users x {args.photos} photos per flow; stub latency {args.latency:.2f}s + {args.image_latency:.2f}s/photo')
+    failures = []
+    for flow, run in (('single', single), ('batch', batch), ('dup', dup)):
+        sessions = {}
+        for i in range(args.users):
+            s = requests.Session()
+            s.post(f'{base}/login', data={'username': f'{flow}{i}', 'password': 'pw'}, allow_redirects=False)
+            sessions[f'{flow}{i}'] = s
+        calls_before = stub.calls
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=run, args=(s, username)) for username, s in sessions.items()]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.perf_counter() - t0
+        with webapp.app.app_context():
+            verified = Target.query.join(User).filter(User.username.startswith(flow), Target.completed == True).count()
+            points = db.session.query(db.func.sum(User.points)).filter(User.username.startswith(flow)).scalar()
+        photos = args.users * args.photos
+        print(f'{flow:>6}: {elapsed:6.2f}s, {photos / elapsed:5.1f} photos/s, {stub.calls - calls_before:3d} vision calls, '
+              f'{verified}/{photos} verified, {points} points')
+        if flow == 'dup' and (verified != args.users or points != 25 * args.users):
+            failures.append(f'one photo for {args.photos} tasks verified {verified} tasks for {args.users} users ({points} points)')
+
+    server.shutdown()
+    stub.shutdown()
+    webapp.job_queue.stop()
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
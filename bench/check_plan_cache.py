@@ -0,0 +1,70 @@
+# CHECK - goals that only differ in case, spacing or trailing punctuation share a
+# cached plan; goals that differ in meaningful symbols (C++, C#, C) never do
+#
+# Checks normalize_goal directly, then stores a plan per goal in a fresh SQLite
+# database and reads every goal back through PlanCache.get.
+#
+#   python bench/check_plan_cache.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAME = [
+    ('learn python in 4 weeks', 'Learn Python in 4 weeks!'),
+    ('Run a 5k', '"run  a 5k."'),
+    ('Learn node.js (fast)', 'learn Node.js fast'),
+]
+DIFFERENT = [
+    'Learn C++ in 4 weeks',
+    'Learn C# in 4 weeks',
+    'learn c in 4 weeks',
+    'Learn F# in 4 weeks',
+    'learn node.js',
+    'learn nodejs',
+]
+
+
+def main():
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.sqlite')}"
+    os.environ['ROLLOVER_ENABLED'] = '0'
+    import app as webapp
+    from plan_cache import normalize_goal
+
+    failures = []
+    for a, b in SAME:
+        if normalize_goal(a) != normalize_goal(b):
+            failures.append(f'{a!r} and {b!r} should share a plan: {normalize_goal(a)!r} != {normalize_goal(b)!r}')
+    keys = {}
+    for goal in DIFFERENT:
+        other = keys.setdefault(normalize_goal(goal), goal)
+        if other != goal:
+            failures.append(f'{goal!r} and {other!r} collide as {normalize_goal(goal)!r}')
+
+    with webapp.app.app_context():
+        for goal in DIFFERENT:
+            webapp.plan_cache.put(goal, {'journey_title': goal, 'milestones': []})
+        webapp.plan_cache._lru.clear()
+        for goal in DIFFERENT:
+            plan = webapp.plan_cache.get(goal)
+            if plan is None or plan['journey_title'] != goal:
+                failures.append(f'{goal!r} got the cached plan of {plan and plan["journey_title"]!r}')
+        for a, b in SAME:
+            webapp.plan_cache.put(a, {'journey_title': a, 'milestones': []})
+            plan = webapp.plan_cache.get(b)
+            if plan is None or plan['journey_title'] != a:
+                failures.append(f'{b!r} did not get the plan cached for {a!r}')
+    webapp.job_queue.stop()
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+    print(f'{len(SAME)} equivalent pairs share a plan, {len(DIFFERENT)} distinct goals keep their own')
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# CHECK - points stay exact when the award endpoints are hammered concurrently
+#
+# Starts the app (threaded werkzeug server, fresh SQLite file) and gives every
+# user a journey of plain tasks and a group with some group targets. Then many
+# threads per user, all at once: log in (the first login of the day awards +5
+# and extends the streak), complete every task and every group target. Each
+# thread submits every form, so every award is attempted --threads times at the
+# same moment. Afterwards each user must have exactly
+# 5 + 10 * tasks + 20 * group targets points, one ledger event per award,
+# User.points must equal the ledger sum, and that must still hold after compaction.
+#
+#   python bench/check_points_ledger.py --users 10 --threads 8
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=8, help='concurrent submitters per user')
+    parser.add_argument('--tasks', type=int, default=8)
+    parser.add_argument('--group-targets', type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'ledger.sqlite')}"
+    import app as webapp
+    from models import db, User, Group, GroupTarget, DailyTask, Milestone, Journey, PointsEvent
+    from materialize import materialize_journey
+    from werkzeug.serving import make_server
+
+    plan = {'journey_title': 'Ledger check', 'milestones': [
+        {'week': 1, 'weekly_goal': 'Practice', 'daily_tasks': [f'Practice drill {i}' for i in range(args.tasks)]}]}
+    with webapp.app.app_context():
+        group = Group(name='ledger')
+        db.session.add(group)
+        db.session.flush()
+        db.session.add_all(GroupTarget(title=f'Group target {i}', group_id=group.id) for i in range(args.group_targets))
+        for i in range(args.users):
+            user = User(username=f'ledger{i}', group_id=group.id, streak=3, last_login=date.today() - timedelta(days=1))
+            user.set_password('pw')
+            db.session.add(user)
+            db.session.flush()
+            materialize_journey(user.id, 'practice', plan)
+        db.session.commit()
+        tasks = {user_id: [task_id for (task_id,) in db.session.query(DailyTask.id).join(Milestone).join(Journey).filter(Journey.user_id == user_id)]
+                 for (user_id,) in db.session.query(User.id)}
+        group_targets = [target_id for (target_id,) in db.session.query(GroupTarget.id)]
+        users = dict(db.session.query(User.username, User.id))
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    errors = Counter()  # status code -> count, for anything but the expected redirect
+    barrier = threading.Barrier(args.users * args.threads)
+
+    def hammer(username):
+        s = requests.Session()
+        barrier.wait()
+        # Every thread logs in at the same moment; only one of them may get the daily bonus
+        r = s.post(f'{base}/login', data={'username': username, 'password': 'pw'}, allow_redirects=False)
+        if r.status_code != 302: errors[r.status_code] += 1
+        user_id = users[username]
+        for task_id in tasks[user_id]:
+            r = s.post(f'{base}/toggle_task/{task_id}', allow_redirects=False)
+            if r.status_code != 302: errors[r.status_code] += 1
+        for target_id in group_targets:
+            r = s.get(f'{base}/complete_group_target/{target_id}', allow_redirects=False)
+            if r.status_code != 302: errors[r.status_code] += 1
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=hammer, args=(username,)) for username in users for _ in range(args.threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    requests_sent = len(threads) * (1 + args.tasks + args.group_targets)
+
+    expected = 5 + 10 * args.tasks + 20 * args.group_targets
+    failures = []
+    with webapp.app.app_context():
+        for user in User.query.all():
+            events = PointsEvent.query.filter_by(user_id=user.id).count()
+            if user.points != expected or events != 1 + args.tasks + args.group_targets or user.streak != 4:
+                failures.append(f'{user.username}: {user.points} points (want {expected}), {events} events, streak {user.streak}')
+        drift_before = webapp.points_ledger.drift()
+        folded = webapp.points_ledger.compact(before=datetime.utcnow() + timedelta(seconds=1))
+        db.session.commit()
+        drift_after = webapp.points_ledger.drift()
+        rows_left = PointsEvent.query.count()
+
+    print(f'{len(threads)} threads, {requests_sent} requests in {elapsed:.2f}s ({requests_sent / elapsed:.0f} req/s)')
+    print(f'non-redirect responses     : {sum(errors.values())} {dict(errors)}')
+    print(f'users with wrong totals    : {len(failures)} (expected {expected} points each)')
+    for failure in failures[:10]:
+        print(f'    {failure}')
+    print(f'ledger drift before/after compaction: {len(drift_before)} / {len(drift_after)} users '
+          f'({folded} events folded into {rows_left} rows)')
+
+    server.shutdown()
+    webapp.job_queue.stop()
+    if failures or drift_before or drift_after or errors or rows_left != args.users:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
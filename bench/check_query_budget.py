@@ -0,0 +1,91 @@
+# QUERY BUDGET CHECK - pages must cost the same number of queries however big their data gets
+#
+# Seeds users with 4-, 12- and 52-week journeys (half the tasks needing photo
+# verification) and renders /dashboard for each; then seeds groups of 5, 500 and
+# 5000 members (10 targets, half the members completing half of them) and
+# renders /groups and each group page twice (cache miss, then hit). Runs with
+# app.testing on and fails if a @query_budget is exceeded or a count grows
+# with the data size.
+#
+#   python bench/check_query_budget.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import journey_plan
+
+
+def main():
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'budget.sqlite')}"
+    import app as webapp
+    from models import db, User
+    from materialize import materialize_journey
+
+    webapp.app.config['TESTING'] = True
+    counts = {}
+    for weeks in (4, 12, 52):
+        with webapp.app.app_context():
+            user = User(username=f'budget{weeks}')
+            user.set_password('pw')
+            db.session.add(user)
+            db.session.flush()
+            materialize_journey(user.id, f'{weeks} week goal', journey_plan(weeks, 7))
+            db.session.commit()
+
+        client = webapp.app.test_client()
+        client.post('/login', data={'username': f'budget{weeks}', 'password': 'pw'})
+        response = client.get('/dashboard')
+        assert response.status_code == 200, response.status_code
+        counts[weeks] = int(response.headers['X-Query-Count'])
+        print(f'{weeks:>2}-week plan: /dashboard ran {counts[weeks]} queries')
+
+    if len(set(counts.values())) != 1:
+        sys.exit(f'FAIL: dashboard query count depends on plan length: {counts}')
+
+    group_counts = {}
+    for members in (5, 500, 5000):
+        group_id = seed_group(webapp.app, db, members)
+        client = webapp.app.test_client()
+        client.post('/login', data={'username': f'group{members}_0', 'password': 'pw'})
+        row = []
+        for path in (f'/group/{group_id}', f'/group/{group_id}', '/groups'):
+            t0 = time.perf_counter()
+            response = client.get(path)
+            elapsed = time.perf_counter() - t0
+            assert response.status_code == 200, response.status_code
+            row.append(int(response.headers['X-Query-Count']))
+            print(f'{members:>4}-member group: {path:<10} ran {row[-1]} queries in {elapsed * 1000:.1f} ms')
+        group_counts[members] = tuple(row)
+
+    if len(set(group_counts.values())) != 1:
+        sys.exit(f'FAIL: group page query counts depend on group size: {group_counts}')
+    print('OK')
+
+
+def seed_group(app, db, members):
+    from sqlalchemy import insert
+    from models import User, Group, GroupTarget, group_target_completions
+    with app.app_context():
+        group = Group(name=f'group{members}')
+        db.session.add(group)
+        db.session.flush()
+        db.session.execute(insert(User), [{'username': f'group{members}_{i}', 'password_hash': '', 'points': i, 'group_id': group.id}
+                                          for i in range(1, members)])
+        user = User(username=f'group{members}_0', group_id=group.id)
+        user.set_password('pw')
+        db.session.add(user)
+        db.session.add_all(GroupTarget(title=f'Target {i}', group_id=group.id) for i in range(10))
+        db.session.flush()
+        user_ids = db.session.scalars(db.select(User.id).where(User.group_id == group.id)).all()
+        target_ids = db.session.scalars(db.select(GroupTarget.id).where(GroupTarget.group_id == group.id)).all()
+        db.session.execute(insert(group_target_completions), [{'user_id': u, 'group_target_id': t}
+                                                              for u in user_ids[::2] for t in target_ids[:5]])
+        db.session.commit()
+        return group.id
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# CHECK - no hot query falls back to a full table scan or a full sort
+#
+# Builds a database the way an old deployment has it (create_all() from before
+# the migrations, without the hot path indexes), upgrades it with migrations.py,
+# seeds a realistic amount of data, ANALYZEs it and runs EXPLAIN on every hot
+# query in the app. Fails (exit 1) when a plan scans a whole table or sorts a
+# whole result set. Works on SQLite (default) or PostgreSQL via DATABASE_URL.
+#
+#   python bench/check_query_plans.py
+#   DATABASE_URL=postgresql://localhost/goals_check python bench/check_query_plans.py
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.sqlite')}"
+os.environ['MIGRATE_ON_STARTUP'] = '0'
+
+from sqlalchemy import and_, insert, or_, select, text, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+USERS, GROUPS, JOURNEYS_PER_USER, WEEKS, TASKS = 3000, 60, 3, 4, 5
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'sqlite')
+def _explain_sqlite(element, compiler, **kw):
+    return 'EXPLAIN QUERY PLAN ' + compiler.process(element.statement, **kw)
+
+
+@compiles(Explain)
+def _explain(element, compiler, **kw):
+    return 'EXPLAIN ' + compiler.process(element.statement, **kw)
+
+
+def hot_queries():
+    from models import (User, Journey, Milestone, DailyTask, Group, GroupTarget, Job, PlanCacheEntry,
+                        VerificationResult, group_target_completions)
+    now = datetime.utcnow()
+    return {
+        'login (user by username)': select(User).where(User.username == 'user42'),
+        'load_user (user by id)': select(User).where(User.id == 42),
+        'dashboard active journey': select(Journey).where(Journey.user_id == 42, Journey.active == True),
+        'dashboard milestones': select(Milestone).where(Milestone.journey_id.in_([100, 101])),
+        'dashboard daily tasks': select(DailyTask).where(DailyTask.milestone_id.in_([400, 401, 402, 403])),
+        'dashboard pending job': select(Job).where(Job.user_id == 42, Job.kind == 'build_journey',
+                                                   Job.status.in_(('queued', 'running'))).order_by(Job.id.desc()).limit(1),
+        'task by target': select(DailyTask).where(DailyTask.target_id == 77).limit(1),
+        'job claim': select(Job.id).where(Job.status == 'queued', Job.run_at <= now).order_by(Job.run_at, Job.id).limit(4),
+        'job lease expiry': select(Job.id).where(Job.status == 'running', Job.locked_at < now),
+        'leaderboard top': select(User.id, User.username, User.points).order_by(User.points.desc(), User.id).limit(100),
+        'leaderboard count ahead': select(func.count()).select_from(User).where(
+            or_(User.points > 500, and_(User.points == 500, User.id < 42))),
+        'group leaderboard': select(User.id, User.username, User.points).where(User.group_id == 3).order_by(
+            User.points.desc(), User.id).limit(51),
+        'group members': select(User).where(User.group_id == 3),
+        'group by name': select(Group).where(Group.name == 'group3'),
+        'group targets': select(GroupTarget).where(GroupTarget.group_id == 3),
+        'group target completions': select(group_target_completions).where(
+            group_target_completions.c.group_target_id.in_([1, 2, 3])),
+        'plan cache by key': select(PlanCacheEntry).where(PlanCacheEntry.key == 'a' * 64),
+        'verification near duplicates': select(VerificationResult).where(
+            VerificationResult.created_at >= now,
+            or_(*(getattr(VerificationResult, f'band{i}') == 5 for i in range(5)))),
+    }
+
+
+def problems(conn, plan_rows):
+    if conn.dialect.name == 'sqlite':
+        # rows are (id, parent, notused, detail)
+        details = [row[3] for row in plan_rows]
+        searched = any(d.startswith('SEARCH ') for d in details)
+        # Sorting what an index SEARCH returned is fine; sorting a whole table is not
+        bad = [d for d in details if (d.startswith('SCAN ') and ' USING ' not in d) or (d == 'USE TEMP B-TREE FOR ORDER BY' and not searched)]
+    else:
+        details = [row[0] for row in plan_rows]
+        bad = [d for d in details if 'Seq Scan' in d]
+    return details, bad
+
+
+def seed(db):
+    from models import User, Group, GroupTarget, Journey, Milestone, DailyTask, Target, Job, group_target_completions
+    rnd = random.Random(1)
+    db.session.execute(insert(Group), [{'name': f'group{g}'} for g in range(GROUPS)])
+    db.session.execute(insert(User), [{'username': f'user{u}', 'password_hash': 'x', 'points': rnd.randint(0, 3000),
+                                       'streak': 0, 'group_id': rnd.randrange(1, GROUPS + 1) if u % 3 else None}
+                                      for u in range(USERS)])
+    db.session.execute(insert(GroupTarget), [{'title': f'target {t}', 'group_id': t % GROUPS + 1} for t in range(GROUPS * 5)])
+    db.session.execute(insert(group_target_completions), [{'user_id': u, 'group_target_id': t}
+                                                          for u in range(1, USERS + 1, 7) for t in range(1, GROUPS * 5 + 1, 37)])
+    db.session.execute(insert(Journey), [{'user_id': u, 'title': 'j', 'original_goal': 'g', 'active': j == JOURNEYS_PER_USER - 1}
+                                         for u in range(1, USERS + 1) for j in range(JOURNEYS_PER_USER)])
+    journeys = USERS * JOURNEYS_PER_USER
+    db.session.execute(insert(Milestone), [{'journey_id': j, 'week': w, 'goal': 'goal'} for j in range(1, journeys + 1) for w in range(1, WEEKS + 1)])
+    db.session.execute(insert(Target), [{'title': 'clean', 'user_id': t % USERS + 1, 'completed': False} for t in range(journeys)])
+    db.session.execute(insert(DailyTask.__table__), [{'milestone_id': m, 'task': 'task', 'completed': False,
+                                                      'target_id': m // WEEKS if i == 0 and m % WEEKS == 0 else None}
+                                                     for m in range(1, journeys * WEEKS + 1) for i in range(TASKS)])
+    statuses = ['done'] * 90 + ['failed'] * 6 + ['queued'] * 3 + ['running']
+    db.session.execute(insert(Job), [{'kind': 'build_journey', 'user_id': u, 'status': statuses[u % len(statuses)], 'payload': '{}',
+                                      'attempts': 1, 'run_at': datetime.utcnow()} for u in range(1, USERS + 1)])
+    db.session.commit()
+
+
+def main():
+    import app as webapp
+    from models import db
+    from migrations import HOT_PATH_INDEXES
+
+    with webapp.app.app_context():
+        # An old deployment: tables from create_all(), none of the new indexes, no schema_migrations
+        db.create_all()
+        with db.engine.begin() as conn:
+            for name, *_ in HOT_PATH_INDEXES:
+                conn.execute(text(f'DROP INDEX IF EXISTS {conn.dialect.identifier_preparer.quote(name)}'))
+        applied = webapp.migrations.upgrade()
+        print(f'applied migrations {applied}; pending now {webapp.migrations.pending()}')
+        seed(db)
+
+        failed = 0
+        with db.engine.connect() as conn:
+            conn.execute(text('ANALYZE'))
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text('SET enable_seqscan = off'))  # so a missing index shows up as a Seq Scan even on small tables
+            for name, statement in hot_queries().items():
+                details, bad = problems(conn, conn.execute(Explain(statement)).all())
+                failed += bool(bad)
+                print(f"{'FAIL' if bad else 'ok  '} {name}")
+                for detail in details:
+                    print(f'       {detail}')
+        if failed:
+            print(f'{failed} hot queries scan or sort whole tables')
+            sys.exit(1)
+        print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# CHECK - the user cache saves queries and never shows a change late
+#
+# Part 1 (in process): renders the main pages with USER_CACHE_ENABLED off and
+# on and reports the queries each request runs (X-Query-Count) and how many the
+# cache saved. Then changes points (task completion) and group membership
+# and checks that the very next request sees the change.
+#
+# Part 2 (two worker processes, one database): logs in on worker A, joins a
+# group through worker B and checks what A shows straight after. With
+# USER_CACHE_BACKEND=sqlite:///... (shared) A must show the new group; with the
+# per-process memory backend A shows the old state until its entry expires.
+#
+#   python bench/check_user_cache.py
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+PAGES = ['/dashboard', '/groups', '/group/1', '/leaderboard']
+
+
+def serve(port):
+    # Worker process for part 2
+    import logging
+    import app as webapp
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, webapp.app, threaded=True).serve_forever()
+
+
+def seed(webapp):
+    from models import db, User, Group
+    from materialize import materialize_journey
+    plan = {'journey_title': 'Cache check', 'milestones': [
+        {'week': 1, 'weekly_goal': 'Practice', 'daily_tasks': [f'Practice drill {i}' for i in range(5)]}]}
+    with webapp.app.app_context():
+        db.session.add_all([Group(name='alpha'), Group(name='beta')])
+        db.session.flush()
+        for name, group_id in (('cached', 1), ('other', None)):
+            user = User(username=name, group_id=group_id)
+            user.set_password('pw')
+            db.session.add(user)
+            db.session.flush()
+            materialize_journey(user.id, 'practice', plan)
+        db.session.commit()
+
+
+def in_process(failures):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'usercache.sqlite')}"
+    import app as webapp
+    from models import db, DailyTask
+    webapp.app.config['QUERY_COUNT_HEADER'] = True
+    seed(webapp)
+    client = webapp.app.test_client()
+    client.post('/login', data={'username': 'cached', 'password': 'pw'})
+
+    counts = {}
+    for enabled in (False, True):
+        webapp.app.config['USER_CACHE_ENABLED'] = enabled
+        webapp.user_cache.backend.clear()
+        for path in PAGES * 2:  # the second round is the one that counts (warm caches)
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+            counts[enabled, path] = int(response.headers['X-Query-Count'])
+    print(f"{'page':<14} {'cache off':>9} {'cache on':>9} {'saved':>6}")
+    for path in PAGES:
+        off, on = counts[False, path], counts[True, path]
+        print(f'{path:<14} {off:>9} {on:>9} {off - on:>6}')
+    print(f'cache stats: {webapp.user_cache.stats()}')
+
+    # Points: complete a task, the next page must show the new total
+    with webapp.app.app_context():
+        task_id = db.session.query(DailyTask.id).first()[0]
+    client.post(f'/toggle_task/{task_id}')
+    if 'aria-valuenow="10"' not in client.get('/dashboard').get_data(as_text=True):
+        failures.append('dashboard did not show the points of a task completed in the previous request')
+    # Group: leave and join another one
+    client.get('/leave_group')
+    if 'You are not currently in a group.' not in client.get('/groups').get_data(as_text=True):
+        failures.append('groups page still showed the group the user had just left')
+    client.get('/join_group/2')
+    if '<h2 class="fw-bold">beta</h2>' not in client.get('/groups').get_data(as_text=True):
+        failures.append('groups page did not show the group the user had just joined')
+    webapp.job_queue.stop()
+
+
+def two_workers(backend, failures):
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'workers.sqlite')}", USER_CACHE_TTL='300',
+               USER_CACHE_BACKEND='memory' if backend == 'memory' else f"sqlite:///{os.path.join(tmp, 'user_cache.sqlite')}",
+               JOB_WORKERS='1')
+    subprocess.run([sys.executable, '-c', f'import sys; sys.path.insert(0, {ROOT!r}); sys.path.insert(0, {os.path.dirname(__file__)!r}); '
+                    'import check_user_cache, app; check_user_cache.seed(app); app.job_queue.stop()'], env=env, check=True)
+    workers = [subprocess.Popen([sys.executable, __file__, '--serve', str(port)], env=env) for port in (18601, 18602)]
+    try:
+        a, b = 'http://127.0.0.1:18601', 'http://127.0.0.1:18602'
+        for base in (a, b):
+            for _ in range(100):
+                try:
+                    requests.get(f'{base}/login', timeout=1)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+        s = requests.Session()
+        s.post(f'{a}/login', data={'username': 'other', 'password': 'pw'})
+        s.get(f'{a}/groups')  # caches the user on A
+        s.get(f'{b}/join_group/1')  # changes it on B
+        seen = '<h2 class="fw-bold">alpha</h2>' in s.get(f'{a}/groups').text
+        print(f'{backend:>6} backend: worker A {"sees" if seen else "does not see"} the group joined on worker B')
+        if backend == 'shared' and not seen:
+            failures.append('shared backend: worker A served a stale user after a change on worker B')
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+
+def main():
+    if sys.argv[1:2] == ['--serve']:
+        return serve(int(sys.argv[2]))
+    failures = []
+    in_process(failures)
+    for backend in ('memory', 'shared'):
+        two_workers(backend, failures)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# LOAD TEST - the whole app under a realistic mix of users, with a baseline to diff against
+#
+# Seeds a fresh SQLite database (--users, --groups, --journeys per user,
+# --weeks x --tasks per journey, two in five tasks needing photo verification,
+# --group-targets per group), starts the stub Gemini server and the app
+# (threaded werkzeug server), then runs --concurrency virtual users for
+# --duration seconds. Each one logs in as its own user and picks actions by
+# weight (MIX): dashboard views, task toggles, leaderboards, group pages, group
+# target completions, new journeys, photo verifications and the odd re-login.
+#
+# Reports per action and overall: requests, req/s, p50/p95/p99 latency, SQL
+# queries per request (X-Query-Count) and errors. --out writes the results as
+# JSON; --baseline diffs against such a file and --max-regression fails the run
+# (exit 1) when any action's p95 grows by more than that many percent or its
+# queries per request go up. The random seed is fixed, so two runs of the same
+# tree drive the same mix.
+#
+#   python bench/loadtest.py --out bench/baseline.json
+#   python bench/loadtest.py --baseline bench/baseline.json --max-regression 20
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stub_gemini import journey_plan, start_stub, stub_base
+from bench_verify_batch import random_photo
+
+MIX = {
+    'dashboard': 35,
+    'toggle_task': 15,
+    'leaderboard': 12,
+    'group_page': 10,
+    'groups': 5,
+    'group_leaderboard': 5,
+    'complete_group_target': 5,
+    'upload_verification': 5,
+    'create_journey': 3,
+    'login': 3,
+    'journey_builder': 2,
+}
+GOALS = ['learn python', 'run a 5k', 'clean my room', 'learn spanish', 'save money', 'read more books']
+
+
+def seed(webapp, args, rnd):
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from models import db, User, Group, GroupTarget, Journey, Milestone, DailyTask, group_target_completions
+    from materialize import materialize_journey
+
+    password_hash = generate_password_hash('pw')  # hashing once keeps seeding fast
+    plan = journey_plan(args.weeks, args.tasks)
+    with webapp.app.app_context():
+        db.session.execute(insert(Group), [{'name': f'group{g}'} for g in range(args.groups)])
+        db.session.execute(insert(GroupTarget), [{'title': f'Group target {g}.{t}', 'group_id': g + 1}
+                                                 for g in range(args.groups) for t in range(args.group_targets)])
+        db.session.execute(insert(User), [{'username': f'user{u}', 'password_hash': password_hash, 'points': rnd.randint(0, 3000),
+                                           'streak': rnd.randint(0, 30), 'group_id': rnd.randrange(1, args.groups + 1) if args.groups and u % 3 else None}
+                                          for u in range(args.users)])
+        for user_id in range(1, args.users + 1):
+            for j in range(args.journeys):
+                materialize_journey(user_id, f'goal {j}', plan)
+        completions = {(rnd.randrange(1, args.users + 1), rnd.randrange(1, args.groups * args.group_targets + 1))
+                       for _ in range(args.users * args.group_targets // 4)} if args.groups and args.group_targets else set()
+        if completions:
+            db.session.execute(insert(group_target_completions), [{'user_id': u, 'group_target_id': t} for u, t in completions])
+        db.session.commit()
+
+        # What each virtual user can act on: its own open tasks and targets, its group's targets
+        users = {}
+        for user in User.query.filter(User.username.in_([f'user{i}' for i in range(args.concurrency)])):
+            tasks = (db.session.query(DailyTask.id, DailyTask.target_id).join(Milestone).join(Journey)
+                     .filter(Journey.user_id == user.id, Journey.active == True, DailyTask.completed == False).all())
+            done = {t for u, t in completions if u == user.id}
+            users[user.username] = {
+                'group_id': user.group_id,
+                'tasks': [task_id for task_id, target_id in tasks if target_id is None],
+                'targets': [target_id for _, target_id in tasks if target_id is not None],
+                'group_targets': [t for (t,) in db.session.query(GroupTarget.id).filter_by(group_id=user.group_id) if t not in done],
+            }
+    return users
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s[0] for s in samples)
+    queries = [s[1] for s in samples if s[1] is not None]
+    return {
+        'requests': len(samples),
+        'rps': round(len(samples) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'errors': sum(1 for s in samples if s[2]),
+    }
+
+
+def print_table(results, baseline=None):
+    print(f"{'action':<22} {'reqs':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6} {'errors':>6}")
+    rows = sorted(results['actions'].items()) + [('TOTAL', results['total'])]
+    for name, r in rows:
+        q = '-' if r['queries_per_request'] is None else f"{r['queries_per_request']:.1f}"
+        print(f"{name:<22} {r['requests']:>6} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {q:>6} {r['errors']:>6}")
+        old = baseline and (baseline['total'] if name == 'TOTAL' else baseline['actions'].get(name))
+        if old:
+            print(f"{'  vs baseline':<22} {'':>6} {delta(r['rps'], old['rps']):>8} {delta(r['p50_ms'], old['p50_ms']):>8} "
+                  f"{delta(r['p95_ms'], old['p95_ms']):>8} {delta(r['p99_ms'], old['p99_ms']):>8} "
+                  f"{delta(r['queries_per_request'], old['queries_per_request'], absolute=True):>6}")
+
+
+def delta(new, old, absolute=False):
+    if new is None or old is None:
+        return '-'
+    if absolute:
+        return f'{new - old:+.1f}'
+    return f'{(new / old - 1) * 100:+.0f}%' if old else '-'
+
+
+def regressions(results, baseline, max_regression):
+    found = []
+    for name, r in results['actions'].items():
+        old = baseline['actions'].get(name)
+        if not old or not old['requests']:
+            continue
+        if old['p95_ms'] and r['p95_ms'] > old['p95_ms'] * (1 + max_regression / 100):
+            found.append(f"{name}: p95 {old['p95_ms']:.1f} -> {r['p95_ms']:.1f} ms")
+        if r['queries_per_request'] is not None and old['queries_per_request'] is not None and r['queries_per_request'] > old['queries_per_request'] + 0.05:
+            found.append(f"{name}: queries per request {old['queries_per_request']} -> {r['queries_per_request']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--group-targets', type=int, default=10, help='targets per group')
+    parser.add_argument('--journeys', type=int, default=2, help='journeys per user (the last one is active)')
+    parser.add_argument('--weeks', type=int, default=4)
+    parser.add_argument('--tasks', type=int, default=5, help='tasks per week')
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds run before measuring')
+    parser.add_argument('--latency', type=float, default=1.0, help='stub Gemini latency in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to diff against')
+    parser.add_argument('--max-regression', type=float, help='with --baseline: fail if a p95 grows by more than this many percent')
+    args = parser.parse_args()
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users (one seeded user per virtual user)')
+
+    stub = start_stub(latency=args.latency, weeks=args.weeks)
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'loadtest.sqlite')}"
+    os.environ['GEMINI_API_BASE'] = stub_base(stub)
+    import app as webapp
+    from werkzeug.serving import make_server
+    webapp.app.config['QUERY_COUNT_HEADER'] = True
+    webapp.app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    users = seed(webapp, args, rnd)
+    print(f'seeded {args.users} users, {args.groups} groups, {args.users * args.journeys} journeys in {time.perf_counter() - t0:.1f}s')
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    samples = defaultdict(list)  # action -> [(seconds, queries, error)]
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from, stop_at = start + args.warmup, start + args.warmup + args.duration
+
+    def virtual_user(index):
+        username = f'user{index}'
+        state = users[username]
+        vu_rnd = random.Random(args.seed * 1000 + index)
+        s = requests.Session()
+        s.post(f'{base}/login', data={'username': username, 'password': 'pw'}, allow_redirects=False)
+        actions, weights = zip(*MIX.items())
+        while time.perf_counter() < stop_at:
+            action = vu_rnd.choices(actions, weights)[0]
+            if action == 'toggle_task' and state['tasks']:
+                call = lambda: s.post(f"{base}/toggle_task/{state['tasks'].pop(vu_rnd.randrange(len(state['tasks'])))}", allow_redirects=False)
+            elif action == 'upload_verification' and state['targets']:
+                target_id = state['targets'].pop(vu_rnd.randrange(len(state['targets'])))
+                photo = random_photo(f'{username}/{target_id}')
+                call = lambda: s.post(f'{base}/upload_verification/{target_id}', files={'file': ('photo.jpg', photo, 'image/jpeg')}, allow_redirects=False)
+            elif action == 'complete_group_target' and state['group_targets']:
+                call = lambda: s.get(f"{base}/complete_group_target/{state['group_targets'].pop()}", allow_redirects=False)
+            elif action in ('group_page', 'group_leaderboard') and state['group_id']:
+                path = f"/group/{state['group_id']}" + ('/leaderboard' if action == 'group_leaderboard' else '')
+                call = lambda: s.get(base + path, allow_redirects=False)
+            elif action == 'leaderboard':
+                call = lambda: s.get(f'{base}/leaderboard', params={'page': vu_rnd.choice((1, 1, 1, 2, 5))}, allow_redirects=False)
+            elif action == 'create_journey':
+                call = lambda: s.post(f'{base}/create_journey', data={'goal': vu_rnd.choice(GOALS)}, allow_redirects=False)
+            elif action == 'login':
+                call = lambda: s.post(f'{base}/login', data={'username': username, 'password': 'pw'}, allow_redirects=False)
+            elif action in ('groups', 'journey_builder'):
+                call = lambda: s.get(f'{base}/{action}', allow_redirects=False)
+            else:
+                action, call = 'dashboard', lambda: s.get(f'{base}/dashboard', allow_redirects=False)
+
+            began = time.perf_counter()
+            try:
+                response = call()
+                queries = response.headers.get('X-Query-Count')
+                sample = (time.perf_counter() - began, int(queries) if queries else None, response.status_code >= 400)
+            except requests.RequestException:
+                sample = (time.perf_counter() - began, None, True)
+            if began >= measure_from:
+                with lock:
+                    samples[action].append(sample)
+
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(args.concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = min(time.perf_counter(), stop_at) - measure_from
+
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline', 'max_regression')},
+        'actions': {action: summarize(action_samples, elapsed) for action, action_samples in samples.items()},
+        'total': summarize([s for action_samples in samples.values() for s in action_samples], elapsed),
+        'gemini_calls': stub.calls,
+    }
+    server.shutdown()
+    stub.shutdown()
+    webapp.job_queue.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != results['config']:
+            print(f"warning: baseline was recorded with a different configuration: {baseline['config']}")
+    print(f'{args.concurrency} virtual users for {elapsed:.1f}s, {results["gemini_calls"]} Gemini calls')
+    print_table(results, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'wrote {args.out}')
+    if baseline and args.max_regression is not None:
+        found = regressions(results, baseline, args.max_regression)
+        for regression in found:
+            print(f'REGRESSION {regression}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# STUB GEMINI SERVER - a local stand-in for generativelanguage.googleapis.com
+#
+# Answers generateContent calls with a canned journey plan (or 'Yes' for vision
+# requests) after a configurable delay, and can fail a fraction of calls with a
+# 503 so retry paths get exercised. streamGenerateContent?alt=sse sends the same
+# plan as `stream_chunks` chunked SSE events, spreading the delay between them.
+# Vision calls take `image_latency` extra seconds per photo, and batch prompts
+# (several photos) get a {"verdicts": [...]} answer with vision_answer for each.
+# Usable as a script or from other benchmarks:
+#
+#   python bench/stub_gemini.py --port 8765 --latency 2.0 --fail-rate 0.1
+#   GEMINI_API_BASE=http://127.0.0.1:8765 gunicorn app:app
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def journey_plan(weeks=4, tasks_per_week=5):
+    verbs = ['Read about', 'Practice', 'Build', 'Review', 'Clean up']
+    return {
+        "journey_title": f"Your {weeks}-Week Journey",
+        "milestones": [
+            {"week": week, "weekly_goal": f"Week {week} focus",
+             "daily_tasks": [f"{verbs[i % len(verbs)]} topic {week}.{i + 1}" for i in range(tasks_per_week)]}
+            for week in range(1, weeks + 1)
+        ],
+    }
+
+
+def gemini_response(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}]}
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # ListModels, for check_models.py
+        return self.send_json(200, {"models": [{"name": "models/gemini-2.5-flash", "supportedGenerationMethods": ["generateContent"]}]})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with server.lock:
+            server.calls += 1
+        if ':streamGenerateContent' in self.path:
+            return self.send_stream(json.dumps(journey_plan(server.weeks)))
+        parts = body.get('contents', [{}])[0].get('parts', [])
+        photos = sum('inline_data' in part for part in parts)
+        time.sleep(server.latency + photos * server.image_latency)
+
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self.send_json(503, {"error": {"code": 503, "message": "The model is overloaded."}})
+
+        if photos and '"verdicts"' in parts[0].get('text', ''):
+            verdicts = [{"photo": i, "verified": server.vision_answer == 'Yes'} for i in range(1, photos + 1)]
+            return self.send_json(200, gemini_response(json.dumps({"verdicts": verdicts})))
+        if photos:
+            return self.send_json(200, gemini_response(server.vision_answer))
+        return self.send_json(200, gemini_response(json.dumps(journey_plan(server.weeks))))
+
+    def send_stream(self, text):
+        server = self.server
+        chunks = max(1, server.stream_chunks)
+        time.sleep(server.latency / (chunks + 1))  # time to first token
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self.send_json(503, {"error": {"code": 503, "message": "The model is overloaded."}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        size = -(-len(text) // chunks)
+        for i in range(0, len(text), size):
+            if i:
+                time.sleep(server.latency / (chunks + 1))
+            event = f"data: {json.dumps(gemini_response(text[i:i + size]))}\r\n\r\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up after a timeout are expected in load tests
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub(port=0, latency=0.5, fail_rate=0.0, weeks=4, vision_answer='Yes', stream_chunks=8, image_latency=0.0):
+    server = StubServer(('127.0.0.1', port), StubGeminiHandler)
+    server.latency, server.fail_rate, server.weeks, server.vision_answer = latency, fail_rate, weeks, vision_answer
+    server.stream_chunks, server.image_latency = stream_chunks, image_latency
+    server.calls, server.lock = 0, threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_base(server):
+    host, port = server.server_address
+    return f"http://{host}:{port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Gemini stub for load tests')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds to wait before answering')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of calls answered with 503')
+    parser.add_argument('--weeks', type=int, default=4)
+    args = parser.parse_args()
+    server = start_stub(args.port, args.latency, args.fail_rate, args.weeks)
+    print(f'Stub Gemini listening on {stub_base(server)}  (export GEMINI_API_BASE={stub_base(server)})')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
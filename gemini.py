@@ -0,0 +1,222 @@
+# GEMINI HELPERS - prompts, API calls (through ai_client) and response parsing
+
+import requests
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+import ai_client
+from ai_provider import AIProvider, AIError, AIUnavailable
+from plan_stream import PlanStreamParser
+
+# Bump whenever journey_prompt() changes so cached plans (plan_cache.py) are not reused
+JOURNEY_PROMPT_VERSION = 1
+
+SAFETY_SETTINGS = [ {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"}, {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}, ]
+
+
+class GeminiError(AIError):
+    # The response came back but could not be turned into a plan (blocked, no JSON, ...)
+    pass
+
+
+class GeminiUnavailable(GeminiError, AIUnavailable):
+    # Timeout, connection error, open circuit breaker, ... - worth retrying later
+    pass
+
+
+class GeminiHTTPError(GeminiUnavailable):
+    # Non-200 from the API
+    def __init__(self, status_code, text):
+        super().__init__(f'Gemini returned {status_code}: {text}')
+        self.status_code = status_code
+        self.text = text
+
+
+def journey_prompt(goal):
+    return f"""
+    You are an expert goal-setter and productivity coach. Your task is to take a user's high-level goal and break it down into a structured, step-by-step "Journey." The plan should be realistic, encouraging, and build momentum over time. The journey should be for 4 weeks if the duration is not mentioned in '{goal}'. Else you should provide the duration plan as mentioned in the'{goal}'
+
+    You must return your response as a single, valid JSON object. Do not include ```json markdown.
+    if duration is not of 4 weeks then change the JSON file accordingly(instead of week 1,week2 etc show something that is more appropriate)
+
+    The JSON object must have this exact structure:
+    {{
+      "journey_title": "Your Generated Title for the Journey",
+      "milestones": [
+        {{"week": 1, "weekly_goal": "A summary of the goal for this week", "daily_tasks": ["Task 1", "Task 2", "Task 3", "Task 4", "Task 5"]}},
+        {{"week": 2, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}},
+        {{"week": 3, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}},
+        {{"week": 4, "weekly_goal": "...", "daily_tasks": ["...", "...", "...", "...", "..."]}}
+      ]
+    }}
+
+    User's Goal: "{goal}"
+    """
+
+
+def parse_journey_response(result_json):
+    if 'candidates' not in result_json or not result_json['candidates']:
+        raise GeminiError('AI response was blocked or empty.')
+    return parse_journey_text(result_json['candidates'][0]['content']['parts'][0]['text'])
+
+
+def parse_journey_text(content_text):
+    json_match = re.search(r'\{.*\}', content_text, re.DOTALL)
+    if not json_match:
+        raise GeminiError('Could not find valid JSON in AI response.')
+
+    journey_data = json.loads(json_match.group(0))
+    # Check the shape up front so a bad plan is never cached or half-inserted
+    if not isinstance(journey_data.get('journey_title'), str) or not isinstance(journey_data.get('milestones'), list):
+        raise GeminiError('AI response is missing the journey title or milestones.')
+    for ms_data in journey_data['milestones']:
+        check_milestone(ms_data)
+    return journey_data
+
+
+def check_milestone(ms_data):
+    if not isinstance(ms_data, dict) or not {'week', 'weekly_goal', 'daily_tasks'} <= set(ms_data) or not isinstance(ms_data['daily_tasks'], list):
+        raise GeminiError('AI response has a malformed milestone.')
+    return ms_data
+
+
+def _generate(data, name):
+    try:
+        response = ai_client.client.generate(data, name=name)
+    except (ai_client.AIClientError, requests.RequestException) as e:
+        raise GeminiUnavailable(str(e))
+    if response.status_code != 200:
+        raise GeminiHTTPError(response.status_code, response.text)
+    return response.json()
+
+
+def generate_journey_plan(goal):
+    data = {"contents": [{"parts": [{"text": journey_prompt(goal)}]}], "safetySettings": SAFETY_SETTINGS}
+    return parse_journey_response(_generate(data, 'journey'))
+
+
+def _stream_text(response):
+    # Text fragments from a streamGenerateContent?alt=sse body ("data: {...}" events)
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        chunk = json.loads(line[len('data:'):])
+        for candidate in chunk.get('candidates', [])[:1]:
+            for part in candidate.get('content', {}).get('parts', []):
+                if 'text' in part:
+                    yield part['text']
+
+
+def stream_journey_plan(goal):
+    # Yields ('title', str) and ('milestone', dict) as they arrive, then ('plan', dict) once the
+    # whole response has been read and shape-checked
+    data = {"contents": [{"parts": [{"text": journey_prompt(goal)}]}], "safetySettings": SAFETY_SETTINGS}
+    parser = PlanStreamParser()
+    try:
+        with ai_client.client.stream_generate(data, name='journey_stream') as response:
+            if response.status_code != 200:
+                raise GeminiHTTPError(response.status_code, response.text)
+            for fragment in _stream_text(response):
+                for kind, value in parser.feed(fragment):
+                    yield kind, check_milestone(value) if kind == 'milestone' else value
+    except (ai_client.AIClientError, requests.RequestException) as e:
+        raise GeminiUnavailable(str(e))
+    except ValueError as e:
+        raise GeminiError(f'Could not parse the streamed AI response: {e}')
+    if not parser.text:
+        raise GeminiError('AI response was blocked or empty.')
+    yield 'plan', parse_journey_text(parser.text)
+
+
+def verification_prompt(title):
+    return f"""
+        You are a inspector. Your goal is to verify if a user has completed the task: '{title}'.
+        Analyze the provided image based on the following criteria:
+        1. Is it related to the task '{title}'
+        2. is the task completed as mentioned in '{title}'?
+        3. Is the document uploaded AI generated or it is really done by the user, respond as 'No' if it is AI generated.
+        After analyzing the image against these criteria, respond with only the word 'Yes' if the room is clean, or only the word 'No' if it is not.
+        """
+
+
+def verify_photo(title, mime_type, base64_data):
+    # True when the vision model answers 'Yes'
+    data = {"contents": [{"parts": [{"text": verification_prompt(title)}, {"inline_data": {"mime_type": mime_type, "data": base64_data}}]}]}
+    result_json = _generate(data, 'vision')
+    try:
+        ai_answer = result_json['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        raise GeminiError('AI vision response was blocked or empty.')
+    return 'yes' in ai_answer.lower()
+
+
+def batch_verification_prompt(titles):
+    tasks = '\n'.join(f'        Photo {i}: {title}' for i, title in enumerate(titles, 1))
+    return f"""
+        You are a inspector. The user claims to have completed the tasks below and sent one photo per task, in the same order:
+{tasks}
+        Analyze every photo on its own, based on the following criteria:
+        1. Is it related to its task
+        2. is the task completed as mentioned in the task?
+        3. Is the document uploaded AI generated or it is really done by the user, it is not verified if it is AI generated.
+        Respond with only a JSON object of the form {{"verdicts": [{{"photo": 1, "verified": true}}, {{"photo": 2, "verified": false}}]}} with one entry per photo.
+        """
+
+
+def verify_photos(photos):
+    # photos: [(title, mime_type, base64_data)] -> one True/False per photo, None when the model gave no verdict
+    parts = [{"text": batch_verification_prompt([title for title, _, _ in photos])}]
+    for i, (_, mime_type, base64_data) in enumerate(photos, 1):
+        parts += [{"text": f"Photo {i}:"}, {"inline_data": {"mime_type": mime_type, "data": base64_data}}]
+    result_json = _generate({"contents": [{"parts": parts}]}, 'vision_batch')
+    try:
+        ai_answer = result_json['candidates'][0]['content']['parts'][0]['text']
+        verdicts = json.loads(re.search(r'\{.*\}', ai_answer, re.DOTALL).group(0))['verdicts']
+    except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+        raise GeminiError('AI vision response was blocked or had no verdicts.')
+    results = [None] * len(photos)
+    for verdict in verdicts:
+        try:
+            index = int(verdict['photo']) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < len(photos):
+            results[index] = verdict.get('verified') is True
+    return results
+
+
+def verify_photo_batches(photos, per_call=4, parallel=2):
+    # Splits the photos into calls of at most `per_call` images, at most `parallel` in flight.
+    # A failed call leaves its photos as None (no verdict) instead of failing the rest.
+    chunks = [photos[i:i + per_call] for i in range(0, len(photos), per_call)]
+
+    def run(chunk):
+        try:
+            return verify_photos(chunk)
+        except GeminiError:
+            return [None] * len(chunk)
+
+    if len(chunks) <= 1 or parallel <= 1:
+        return [verdict for chunk in chunks for verdict in run(chunk)]
+    with ThreadPoolExecutor(max_workers=min(parallel, len(chunks))) as pool:
+        return [verdict for verdicts in pool.map(run, chunks) for verdict in verdicts]
+
+
+class GeminiProvider(AIProvider):
+    # AI_PROVIDER=gemini (see ai_provider.py)
+    name = 'gemini'
+
+    def generate_journey_plan(self, goal):
+        return generate_journey_plan(goal)
+
+    def stream_journey_plan(self, goal):
+        return stream_journey_plan(goal)
+
+    def verify_photo(self, title, mime_type, base64_data):
+        return verify_photo(title, mime_type, base64_data)
+
+    def verify_photo_batches(self, photos, per_call=4, parallel=2):
+        return verify_photo_batches(photos, per_call, parallel)
+
+    def stats(self):
+        return ai_client.client.stats()
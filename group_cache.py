@@ -0,0 +1,117 @@
+# GROUP PAGE CACHE - group pages that cost the same for 5 or 5,000 members
+#
+# Everything on a group page that is the same for every viewer (the target list
+# with completion counts and a few completer names, the member count and the
+# top members by points) is built from a handful of aggregate queries, rendered
+# once with the macros in group_fragments.html and kept per group. The
+# per-viewer part, the "Mark as Done" button, is a hole in the cached target list
+# that is filled in per request from one set lookup of the viewer's completions.
+#
+# Entries are keyed on Group.version, which the join/leave/add/complete routes
+# bump in the same transaction as their change (bump()). Since the version comes
+# from the group row the page loads anyway, any worker notices any change at no
+# extra cost. GROUP_CACHE_TTL only bounds how stale member points may get.
+
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import get_template_attribute
+from markupsafe import Markup
+from sqlalchemy import func, select, update
+from models import db, User, Group, GroupTarget, group_target_completions
+
+GroupFragments = namedtuple('GroupFragments', 'version built_at member_count targets members')
+TargetSummary = namedtuple('TargetSummary', 'id title completions completers')
+_ACTION_HOLE = re.compile(r'<!--group-target-action:(\d+)-->')
+
+
+def bump(group_id):
+    # Call in the same transaction as any change that shows on the group page
+    if group_id is not None:
+        db.session.execute(update(Group).where(Group.id == group_id).values(version=Group.version + 1)
+                           .execution_options(synchronize_session=False))
+
+
+def member_counts():
+    # (id, name, member count) for every group - one GROUP BY instead of loading every member
+    return db.session.execute(select(Group.id, Group.name, func.count(User.id).label('member_count')).outerjoin(User, User.group_id == Group.id)
+                              .group_by(Group.id, Group.name).order_by(Group.name)).all()
+
+
+def completed_by(user_id, group_id):
+    return set(db.session.scalars(select(group_target_completions.c.group_target_id)
+                                  .join(GroupTarget, GroupTarget.id == group_target_completions.c.group_target_id)
+                                  .where(group_target_completions.c.user_id == user_id, GroupTarget.group_id == group_id)))
+
+
+class GroupPageCache:
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('GROUP_CACHE_SIZE', 500)
+        app.config.setdefault('GROUP_CACHE_TTL', 30)
+        app.config.setdefault('GROUP_PAGE_MEMBERS', 50)
+        app.config.setdefault('GROUP_PAGE_COMPLETERS', 3)
+        app.extensions['group_cache'] = self
+
+    def fragments(self, group):
+        with self._lock:
+            entry = self._entries.get(group.id)
+            if entry is not None and entry.version == group.version and time.monotonic() - entry.built_at < self.app.config['GROUP_CACHE_TTL']:
+                self._entries.move_to_end(group.id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._build(group)
+        with self._lock:
+            self._entries[group.id] = entry
+            self._entries.move_to_end(group.id)
+            while len(self._entries) > self.app.config['GROUP_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+        return entry
+
+    def render_targets(self, fragments, done):
+        # Fills the per-viewer holes in the cached target list
+        action = get_template_attribute('group_fragments.html', 'target_action')
+        return Markup(_ACTION_HOLE.sub(lambda m: str(action(int(m.group(1)), int(m.group(1)) in done)), fragments.targets))
+
+    def _build(self, group):
+        config = self.app.config
+        member_count = db.session.scalar(select(func.count(User.id)).where(User.group_id == group.id))
+        members = db.session.execute(select(User.id, User.username, User.points).where(User.group_id == group.id)
+                                     .order_by(User.points.desc(), User.id).limit(config['GROUP_PAGE_MEMBERS'])).all()
+
+        completions = group_target_completions.c
+        targets = db.session.execute(select(GroupTarget.id, GroupTarget.title, func.count(completions.user_id))
+                                     .outerjoin(group_target_completions, completions.group_target_id == GroupTarget.id)
+                                     .where(GroupTarget.group_id == group.id)
+                                     .group_by(GroupTarget.id, GroupTarget.title).order_by(GroupTarget.id)).all()
+
+        # First few completer names per target, in one windowed query
+        ranked = (select(completions.group_target_id, User.username,
+                         func.row_number().over(partition_by=completions.group_target_id, order_by=completions.user_id).label('n'))
+                  .join(User, User.id == completions.user_id)
+                  .join(GroupTarget, GroupTarget.id == completions.group_target_id)
+                  .where(GroupTarget.group_id == group.id).subquery())
+        names = {}
+        for target_id, username in db.session.execute(select(ranked.c.group_target_id, ranked.c.username)
+                                                      .where(ranked.c.n <= config['GROUP_PAGE_COMPLETERS'])
+                                                      .order_by(ranked.c.group_target_id, ranked.c.n)):
+            names.setdefault(target_id, []).append(username)
+
+        summaries = [TargetSummary(target_id, title, count, names.get(target_id, [])) for target_id, title, count in targets]
+        targets_html = get_template_attribute('group_fragments.html', 'target_list')(group, summaries)
+        members_html = get_template_attribute('group_fragments.html', 'member_list')(group, member_count, members)
+        return GroupFragments(group.version, time.monotonic(), member_count, str(targets_html), Markup(members_html))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,37 @@
+# GUNICORN - settings picked up by `gunicorn` from the working directory
+#
+# The app is loaded once in the master (preload_app) through create_app(), which
+# applies migrations and compiles every template, and the workers are forked
+# from it ready to serve. GUNICORN_PRELOAD=0 makes every worker load the app
+# itself instead (needed for --reload). Workers and port come from gunicorn's
+# usual WEB_CONCURRENCY and PORT.
+
+import os
+import sys
+
+wsgi_app = 'app:create_app()'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Threaded workers: an open /journey_stream holds a thread, not a whole worker, and the job
+# queue's threads live in the same processes. Each stream ends after JOURNEY_STREAM_SECONDS
+# (25 by default), well inside the timeout.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+
+def post_fork(server, worker):
+    # Database connections opened by the master stay with the master; each worker opens its own
+    webapp = sys.modules.get('app')
+    if webapp is None:
+        return
+    with webapp.app.app_context():
+        for engine in webapp.db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Runs with or without preload, once the worker has the app. Job threads start now,
+    # so jobs left queued by a restart or deploy don't wait for the next enqueue.
+    webapp = sys.modules['app']
+    webapp.job_queue.start()
+    webapp.rollover.start()
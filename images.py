@@ -0,0 +1,139 @@
+# IMAGE PIPELINE - verification photos from the upload stream to the vision model
+#
+# The upload is streamed to disk in chunks (hashing and size-capping as it goes)
+# and kept under its sha256 name, so users can't overwrite each other's files.
+# Photos larger than VISION_MAX_SIDE pixels are decoded at reduced scale,
+# downscaled and re-encoded before being sent to Gemini; small JPEG/PNG files are
+# sent as they are. Every call returns the byte counts, the largest buffer held
+# and a 64-bit perceptual hash (dHash) used to spot re-submitted photos.
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+FORMATS = {'JPEG': ('jpg', 'image/jpeg'), 'PNG': ('png', 'image/png')}
+# Refuse decompression bombs long before they are decoded (checked in ingest, from the header alone)
+MAX_PIXELS = 50_000_000
+
+
+class ImageError(ValueError):
+    pass
+
+
+class ImageTooLarge(ImageError):
+    pass
+
+
+@dataclass
+class PreparedImage:
+    path: str
+    sha256: str
+    mime_type: str
+    data: bytes
+    bytes_in: int
+    width: int
+    height: int
+    peak_bytes: int
+    phash: int
+
+    @property
+    def bytes_out(self):
+        return len(self.data)
+
+    def base64(self):
+        return base64.b64encode(self.data).decode('ascii')
+
+
+def dhash(img):
+    # Difference hash: 1 bit per neighbouring-pixel comparison on a 9x8 grayscale thumbnail.
+    # Re-saves, resizes and small crops of the same photo land within a few bits.
+    small = ImageOps.grayscale(img).resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _spool(stream, folder, max_bytes):
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(f'Photo is too large (limit is {max_bytes // (1024 * 1024)} MB).')
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def ingest(stream, folder, max_bytes=10 * 1024 * 1024, max_side=1024, quality=85, max_pixels=MAX_PIXELS):
+    os.makedirs(folder, exist_ok=True)
+    tmp_path, sha256, bytes_in = _spool(stream, folder, max_bytes)
+    try:
+        with Image.open(tmp_path) as img:
+            if img.format not in FORMATS:
+                raise ImageError('Only JPEG and PNG photos can be verified.')
+            ext, mime_type = FORMATS[img.format]
+            width, height = img.size
+            if width * height > max_pixels:
+                raise ImageTooLarge(f'Photo has too many pixels ({width}x{height}).')
+
+            if max(width, height) <= max_side:
+                # Already small enough - send the original bytes untouched
+                with open(tmp_path, 'rb') as f:
+                    data = f.read()
+                peak_bytes = len(data)
+                phash = dhash(ImageOps.exif_transpose(img))
+            else:
+                if img.format == 'JPEG':
+                    img.draft('RGB', (max_side, max_side))  # let the decoder scale down by 1/2..1/8 for free
+                decoded = ImageOps.exif_transpose(img)
+                decoded_bytes = decoded.width * decoded.height * len(decoded.getbands())
+                decoded.thumbnail((max_side, max_side))
+                phash = dhash(decoded)
+                buffer = io.BytesIO()
+                decoded.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True)
+                data = buffer.getvalue()
+                mime_type = 'image/jpeg'
+                width, height = decoded.size
+                peak_bytes = max(decoded_bytes, len(data))
+    except ImageError:
+        os.remove(tmp_path)
+        raise
+    except (OSError, Image.DecompressionBombError) as e:
+        os.remove(tmp_path)
+        raise ImageError(f'Could not read the photo: {e}')
+
+    path = os.path.join(folder, f'{sha256}.{ext}')
+    if os.path.exists(path):
+        os.remove(tmp_path)  # same photo uploaded before
+    else:
+        os.replace(tmp_path, path)
+
+    prepared = PreparedImage(path, sha256, mime_type, data, bytes_in, width, height, peak_bytes, phash)
+    log.info('verification image %s: %d bytes in, %d bytes out (%dx%d %s), peak buffer %d bytes',
+             sha256[:12], prepared.bytes_in, prepared.bytes_out, width, height, mime_type, prepared.peak_bytes)
+    return prepared
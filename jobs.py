@@ -0,0 +1,199 @@
+# BACKGROUND JOBS - DB-backed queue + per-process worker threads
+#
+# Jobs are rows in the `job` table, so every gunicorn worker can enqueue and
+# claim them without an external broker. Each process runs a small thread pool
+# that claims due jobs, runs the registered handler inside an app context and
+# stores the result (or the error) back on the row.
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from models import db, Job
+
+log = logging.getLogger(__name__)
+
+class RetryJob(Exception):
+    # Raise from a handler when the failure is temporary (e.g. a non-200 from Gemini)
+    pass
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._next_recovery = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('JOB_WORKERS', 4)
+        app.config.setdefault('JOB_MAX_ATTEMPTS', 3)
+        app.config.setdefault('JOB_RETRY_BACKOFF', 2.0)
+        app.config.setdefault('JOB_POLL_INTERVAL', 0.5)
+        app.config.setdefault('JOB_LEASE_SECONDS', 300)
+        # How often expired leases are looked for, and the pause after an unexpected error
+        app.config.setdefault('JOB_RECOVERY_INTERVAL', 30)
+        app.config.setdefault('JOB_ERROR_BACKOFF', 5.0)
+        app.extensions['job_queue'] = self
+
+    def handler(self, kind):
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def enqueue(self, kind, payload, user_id=None, run_at=None):
+        job = Job(kind=kind, user_id=user_id, payload=json.dumps(payload), run_at=run_at or datetime.utcnow())
+        db.session.add(job)
+        db.session.commit()
+        self.start()
+        self._wakeup.set()
+        return job
+
+    # Worker pool
+
+    def start(self):
+        # Threads are started in the serving process, never at import, so forking
+        # servers don't inherit half-started pools: at worker boot (gunicorn.conf.py)
+        # and again on enqueue, which also replaces threads that died.
+        if len(self._threads) == self.app.config['JOB_WORKERS'] and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            self._stopping.clear()
+            names = {t.name for t in self._threads}
+            for i in range(self.app.config['JOB_WORKERS']):
+                if f'job-worker-{i}' in names:
+                    continue
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job_id = None
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= self._next_recovery:
+                        self._recover()
+                    job_id = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+                except Exception:
+                    # e.g. "database is locked": the thread carries on after a pause. A job
+                    # claimed before the error is picked up again when its lease expires.
+                    log.exception('job worker %s failed', threading.current_thread().name)
+                    self._stopping.wait(self.app.config['JOB_ERROR_BACKOFF'])
+                    continue
+                finally:
+                    db.session.remove()
+            if job_id is None:
+                self._wakeup.wait(self.app.config['JOB_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def _recover(self):
+        # Jobs whose worker died mid-run go back on the queue once their lease expires,
+        # or fail if they have used up their attempts. One thread per interval does it.
+        with self._lock:
+            if time.monotonic() < self._next_recovery:
+                return
+            self._next_recovery = time.monotonic() + self.app.config['JOB_RECOVERY_INTERVAL']
+        now = datetime.utcnow()
+        expired = Job.query.filter(Job.status == 'running', Job.locked_at < now - timedelta(seconds=self.app.config['JOB_LEASE_SECONDS']))
+        expired.filter(Job.attempts >= self.app.config['JOB_MAX_ATTEMPTS']).update(
+            {Job.status: 'failed', Job.error: 'The worker running this job stopped.', Job.finished_at: now}, synchronize_session=False)
+        expired.filter(Job.attempts < self.app.config['JOB_MAX_ATTEMPTS']).update({Job.status: 'queued'}, synchronize_session=False)
+        db.session.commit()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        candidates = db.session.query(Job.id).filter(Job.status == 'queued', Job.run_at <= now).order_by(Job.run_at, Job.id).limit(self.app.config['JOB_WORKERS']).all()
+        for (job_id,) in candidates:
+            # Conditional UPDATE = atomic claim; only one worker can flip queued -> running
+            claimed = Job.query.filter_by(id=job_id, status='queued').update(
+                {Job.status: 'running', Job.locked_at: now, Job.attempts: Job.attempts + 1}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def _run(self, job_id):
+        job = db.session.get(Job, job_id)
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for job kind {job.kind!r}')
+            result = handler(json.loads(job.payload), job)
+        except RetryJob as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if job.attempts < self.app.config['JOB_MAX_ATTEMPTS']:
+                delay = self.app.config['JOB_RETRY_BACKOFF'] * (2 ** (job.attempts - 1))
+                job.status = 'queued'
+                job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+                job.error = str(e)
+            else:
+                self._finish(job, 'failed', error=str(e))
+            db.session.commit()
+            return
+        except Exception:
+            # The details are for the log; job.error is shown to the user
+            log.exception('job %s (%s) failed', job_id, job.kind)
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            self._finish(job, 'failed', error='Something went wrong. Please try again.')
+            db.session.commit()
+            return
+        self._finish(job, 'done', result=result)
+        db.session.commit()
+
+    def checkpoint(self, job, progress):
+        # For long handlers that must publish partial work (e.g. streamed journeys):
+        # commits everything so far, exposes `progress` as the job's result while it
+        # is still running, and renews the lease
+        job.result = json.dumps(progress)
+        job.locked_at = datetime.utcnow()
+        db.session.commit()
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = json.dumps(result) if result is not None else None
+        job.error = error
+        job.finished_at = datetime.utcnow()
+
+    # Status lookups (used by the polling endpoint)
+
+    def status(self, job):
+        return {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'attempts': job.attempts,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error,
+        }
+
+    def wait(self, job_ids, timeout=60, interval=0.1):
+        # Blocks until every job has finished; only meant for scripts and benchmarks
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pending = Job.query.filter(Job.id.in_(job_ids), Job.status.in_(('queued', 'running'))).count()
+            db.session.commit()
+            if not pending:
+                return True
+            time.sleep(interval)
+        return False
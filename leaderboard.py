@@ -0,0 +1,122 @@
+# LEADERBOARD - cached top-N, pagination, "around me" and per-group boards
+#
+# The top LEADERBOARD_CACHE_SIZE users are kept in memory, sorted by points
+# (ties: oldest account first). Routes that change points call points_changed()
+# so the cache is updated in place instead of re-sorting the user table; it is
+# also reloaded every LEADERBOARD_REFRESH_SECONDS to pick up changes made by
+# other gunicorn workers. Anything past the cached top uses indexed
+# ORDER BY points / COUNT(*) queries, never a full load of the table.
+
+import bisect
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import or_, and_
+from models import db, User
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'position id username points')
+
+
+class Leaderboard:
+    def __init__(self, app=None):
+        self._keys = []  # sorted (-points, id)
+        self._names = {}  # id -> username for cached users
+        self._complete = False  # True when every user fits in the cache
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('LEADERBOARD_CACHE_SIZE', 100)
+        app.config.setdefault('LEADERBOARD_REFRESH_SECONDS', 30)
+        app.config.setdefault('LEADERBOARD_PAGE_SIZE', 50)
+        app.extensions['leaderboard'] = self
+
+    @property
+    def size(self):
+        return self.app.config['LEADERBOARD_CACHE_SIZE']
+
+    # Cached top-N
+
+    def refresh(self):
+        rows = db.session.query(User.id, User.username, User.points).order_by(User.points.desc(), User.id).limit(self.size).all()
+        with self._lock:
+            self._keys = [(-(points or 0), user_id) for user_id, _, points in rows]
+            self._names = {user_id: username for user_id, username, _ in rows}
+            self._complete = len(rows) < self.size
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.app.config['LEADERBOARD_REFRESH_SECONDS']:
+            self.refresh()
+
+    def points_changed(self, user):
+        # Call after committing a change to user.points (or a new user)
+        if self._loaded_at is None:
+            return
+        key = (-(user.points or 0), user.id)
+        with self._lock:
+            was_cached = user.id in self._names
+            if was_cached:
+                self._keys = [k for k in self._keys if k[1] != user.id]
+                del self._names[user.id]
+            if self._complete or (self._keys and key < self._keys[-1]):
+                bisect.insort(self._keys, key)
+                self._names[user.id] = user.username
+                while len(self._keys) > self.size:
+                    _, dropped = self._keys.pop()
+                    del self._names[dropped]
+                    self._complete = False
+            elif was_cached:
+                # The user fell out of the top-N and someone uncached should take the slot
+                self._loaded_at = None
+
+    def top(self, limit=None):
+        self._ensure_fresh()
+        with self._lock:
+            keys = self._keys[:limit] if limit else list(self._keys)
+            return [LeaderboardEntry(i + 1, user_id, self._names[user_id], -neg_points) for i, (neg_points, user_id) in enumerate(keys)]
+
+    # Pages and positions
+
+    def page(self, page=1, per_page=None):
+        # Returns (entries, has_next)
+        per_page = per_page or self.app.config['LEADERBOARD_PAGE_SIZE']
+        offset = (max(page, 1) - 1) * per_page
+        cached = self.top()
+        if offset + per_page < len(cached) or self._complete:
+            return cached[offset:offset + per_page], offset + per_page < len(cached)
+        rows = db.session.query(User.id, User.username, User.points).order_by(User.points.desc(), User.id).offset(offset).limit(per_page + 1).all()
+        entries = [LeaderboardEntry(offset + i + 1, user_id, username, points or 0) for i, (user_id, username, points) in enumerate(rows)]
+        return entries[:per_page], len(entries) > per_page
+
+    def position(self, user):
+        for entry in self.top():
+            if entry.id == user.id:
+                return entry.position
+        return self._count_ahead(user) + 1
+
+    def _count_ahead(self, user):
+        points = user.points or 0
+        return User.query.filter(or_(User.points > points, and_(User.points == points, User.id < user.id))).count()
+
+    def around(self, user, span=3):
+        points = user.points or 0
+        position = self._count_ahead(user) + 1
+        above = db.session.query(User.id, User.username, User.points).filter(
+            or_(User.points > points, and_(User.points == points, User.id < user.id))).order_by(User.points, User.id.desc()).limit(span).all()
+        below = db.session.query(User.id, User.username, User.points).filter(
+            or_(User.points < points, and_(User.points == points, User.id > user.id))).order_by(User.points.desc(), User.id).limit(span).all()
+        rows = list(reversed(above)) + [(user.id, user.username, points)] + below
+        first = position - len(above)
+        return [LeaderboardEntry(first + i, user_id, username, pts or 0) for i, (user_id, username, pts) in enumerate(rows)]
+
+    def group_page(self, group_id, page=1, per_page=None):
+        per_page = per_page or self.app.config['LEADERBOARD_PAGE_SIZE']
+        offset = (max(page, 1) - 1) * per_page
+        rows = db.session.query(User.id, User.username, User.points).filter(User.group_id == group_id).order_by(
+            User.points.desc(), User.id).offset(offset).limit(per_page + 1).all()
+        entries = [LeaderboardEntry(offset + i + 1, user_id, username, points or 0) for i, (user_id, username, points) in enumerate(rows)]
+        return entries[:per_page], len(entries) > per_page
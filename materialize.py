@@ -0,0 +1,85 @@
+# JOURNEY MATERIALIZATION - turn a parsed plan into Journey/Milestone/DailyTask/Target rows
+#
+# Instead of one ORM object (and one INSERT) per row, every table is written
+# with a single batched INSERT. Milestone and Target ids come back through
+# RETURNING (in parameter order) and are used to wire up the DailyTask rows.
+# On PostgreSQL each table is one round-trip; SQLite can't guarantee RETURNING
+# order for a batch, so SQLAlchemy sends those rows one by one in-process.
+# Nothing is put in the session's identity map; the caller commits.
+
+import re
+from datetime import datetime
+from sqlalchemy import delete, insert, select, update
+from models import db, Journey, Milestone, DailyTask, Target
+
+VERIFICATION_KEYWORDS = ['clean', 'organize', 'cook', 'build', 'draw', 'create', 'make']
+_needs_verification = re.compile('|'.join(map(re.escape, VERIFICATION_KEYWORDS)))
+
+
+def needs_verification(task_str):
+    return _needs_verification.search(task_str.lower()) is not None
+
+
+def _insert_returning_ids(model, rows):
+    if not rows:
+        return []
+    if db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+        return list(db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows))
+    # Databases without multi-row RETURNING get one INSERT per row
+    return [db.session.execute(insert(model).values(**row)).inserted_primary_key[0] for row in rows]
+
+
+def materialize_journey(user_id, goal, journey_data):
+    # Only switch journeys once the new plan has actually arrived
+    db.session.execute(update(Journey).where(Journey.user_id == user_id, Journey.active == True).values(active=False, replaced_at=datetime.utcnow()))
+
+    journey_id = db.session.execute(insert(Journey).values(user_id=user_id, title=journey_data['journey_title'], original_goal=goal, active=True)).inserted_primary_key[0]
+    add_milestones(journey_id, user_id, journey_data['milestones'])
+    return journey_id
+
+
+def add_milestones(journey_id, user_id, milestones):
+    milestone_ids = _insert_returning_ids(Milestone, [
+        {'journey_id': journey_id, 'week': ms_data['week'], 'goal': ms_data['weekly_goal']} for ms_data in milestones
+    ])
+
+    tasks, targets = [], []
+    for milestone_id, ms_data in zip(milestone_ids, milestones):
+        for task_str in ms_data['daily_tasks']:
+            task = {'milestone_id': milestone_id, 'task': task_str, 'completed': False, 'target_id': None}
+            if needs_verification(task_str):
+                targets.append((task, {'title': task_str, 'user_id': user_id, 'completed': False, 'verification_required': True, 'verification_status': 'pending'}))
+            tasks.append(task)
+
+    target_ids = _insert_returning_ids(Target, [target for _, target in targets])
+    for (task, _), target_id in zip(targets, target_ids):
+        task['target_id'] = target_id
+
+    if tasks:
+        # Core insert: the ORM bulk path would split the batch wherever target_id is None
+        db.session.execute(insert(DailyTask.__table__), tasks)
+    return milestone_ids
+
+
+# Streamed plans: the journey row is created inactive, filled week by week as the
+# milestones arrive, and only swapped in for the old journey once the plan is complete.
+
+def start_journey(user_id, goal, title):
+    return db.session.execute(insert(Journey).values(user_id=user_id, title=title, original_goal=goal, active=False)).inserted_primary_key[0]
+
+
+def activate_journey(user_id, journey_id, title):
+    db.session.execute(update(Journey).where(Journey.user_id == user_id, Journey.id != journey_id, Journey.active == True)
+                       .values(active=False, replaced_at=datetime.utcnow()))
+    db.session.execute(update(Journey).where(Journey.id == journey_id).values(active=True, title=title))
+
+
+def discard_journey(journey_id):
+    # Removes a half-streamed journey after a failed or retried build
+    milestone_ids = select(Milestone.id).where(Milestone.journey_id == journey_id).scalar_subquery()
+    target_ids = list(db.session.scalars(select(DailyTask.target_id).where(DailyTask.milestone_id.in_(milestone_ids), DailyTask.target_id.is_not(None))))
+    db.session.execute(delete(DailyTask).where(DailyTask.milestone_id.in_(milestone_ids)))
+    if target_ids:
+        db.session.execute(delete(Target).where(Target.id.in_(target_ids)))
+    db.session.execute(delete(Milestone).where(Milestone.journey_id == journey_id))
+    db.session.execute(delete(Journey).where(Journey.id == journey_id))
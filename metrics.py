@@ -0,0 +1,206 @@
+# METRICS - where the time goes, as Prometheus text on /metrics
+#
+# With METRICS_ENABLED on, every request records its latency per endpoint, its
+# status, its body size (photo uploads), how many SQL statements it ran and how
+# long they took, and how long each template took to render. Outbound AI calls
+# are timed by ai_client itself; /metrics exposes those histograms too, plus the
+# numbers from every extension with a stats() method (plan, group page and user
+# caches, AI provider) and the job queue depth.
+#
+# SLOW_REQUEST_SECONDS > 0 logs one line per request slower than that, with its
+# SQL and template time. With both off nothing is hooked in at all.
+#
+# Every worker process keeps its own numbers; scrape each worker (or put one
+# worker per port) rather than expecting a total across processes.
+
+import logging
+import math
+import threading
+import time
+from flask import Response, abort, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+import ai_client
+from ai_client import LatencyHistogram
+from models import db, Job
+from query_counter import query_count
+
+log = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, float('inf'))
+BODY_BUCKETS = (1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, float('inf'))
+_sql_latency = None  # the enabled Metrics' histogram, fed by the engine events below
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.requests = {}  # (endpoint, method) -> LatencyHistogram
+        self.statuses = {}  # (endpoint, method, status) -> count
+        self.bodies = {}  # endpoint -> LatencyHistogram of bytes
+        self.sql = {}  # endpoint -> [statements, seconds]
+        self.sql_latency = LatencyHistogram(SQL_BUCKETS)
+        self.templates = {}  # template name -> LatencyHistogram
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('METRICS_ENABLED', False)
+        # Optional bearer token for /metrics; without one it is open to anyone who can reach it
+        app.config.setdefault('METRICS_TOKEN', '')
+        app.config.setdefault('SLOW_REQUEST_SECONDS', 0)
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED'] and not app.config['SLOW_REQUEST_SECONDS']:
+            return
+
+        global _sql_latency
+        _sql_latency = self.sql_latency
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not event.contains(Engine, 'before_cursor_execute', _sql_start):
+            event.listen(Engine, 'before_cursor_execute', _sql_start)
+            event.listen(Engine, 'after_cursor_execute', _sql_end)
+        before_render_template.connect(_render_start, app)
+        template_rendered.connect(self._render_end, app)
+        if app.config['METRICS_ENABLED']:
+            app.add_url_rule('/metrics', 'metrics', self._view)
+
+    def _histogram(self, table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = table.setdefault(key, LatencyHistogram(buckets))
+        return histogram
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        self._histogram(self.requests, (endpoint, request.method), REQUEST_BUCKETS).observe(elapsed, response.status_code >= 500)
+        key = (endpoint, request.method, response.status_code)
+        with self._lock:
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            sql = self.sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += query_count()
+            sql[1] += g.get('sql_seconds', 0.0)
+        if request.content_length:
+            self._histogram(self.bodies, endpoint, BODY_BUCKETS).observe(request.content_length)
+
+        slow = self.app.config['SLOW_REQUEST_SECONDS']
+        if slow and elapsed >= slow:
+            log.warning('slow request: %s %s -> %s in %.3fs (%d SQL statements in %.3fs, templates %.3fs)',
+                        request.method, request.path, response.status_code, elapsed,
+                        query_count(), g.get('sql_seconds', 0.0), g.get('template_seconds', 0.0))
+        return response
+
+    def _render_end(self, sender, template, context, **extra):
+        stack = g.get('render_starts') if has_request_context() else None
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        if not stack:  # a template rendered while rendering another is already inside its time
+            g.template_seconds = g.get('template_seconds', 0.0) + elapsed
+        self._histogram(self.templates, template.name or 'string', REQUEST_BUCKETS).observe(elapsed)
+
+    # Exposition
+
+    def _view(self):
+        token = self.app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        out = []
+        _histograms(out, 'app_request_duration_seconds', 'Request latency by endpoint (time to the first byte for streams).',
+                    ('endpoint', 'method'), self.requests)
+        _header(out, 'app_requests_total', 'counter', 'Requests by endpoint and status.')
+        for (endpoint, method, status), count in sorted(self.statuses.items()):
+            out.append(f'app_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+        _histograms(out, 'app_request_body_bytes', 'Request body sizes (uploads).', ('endpoint',), {(k,): v for k, v in self.bodies.items()})
+        _header(out, 'app_sql_queries_total', 'counter', 'SQL statements run by requests, by endpoint.')
+        for endpoint, (count, _) in sorted(self.sql.items()):
+            out.append(f'app_sql_queries_total{_labels(endpoint=endpoint)} {count}')
+        _header(out, 'app_sql_seconds_total', 'counter', 'Time spent in SQL statements by requests, by endpoint.')
+        for endpoint, (_, seconds) in sorted(self.sql.items()):
+            out.append(f'app_sql_seconds_total{_labels(endpoint=endpoint)} {seconds:.6f}')
+        _histograms(out, 'app_sql_query_duration_seconds', 'Duration of each SQL statement (requests and background jobs).',
+                    (), {(): self.sql_latency})
+        _histograms(out, 'app_template_render_seconds', 'Template render time.', ('template',),
+                    {(k,): v for k, v in self.templates.items()})
+        _histograms(out, 'app_ai_call_duration_seconds', 'Outbound Gemini calls by call type.', ('call',),
+                    {(k,): v for k, v in ai_client.client.latency.items()})
+        _header(out, 'app_ai_call_failures_total', 'counter', 'Failed Gemini calls (errors, timeouts, 429/5xx).')
+        for name, histogram in sorted(ai_client.client.latency.items()):
+            out.append(f'app_ai_call_failures_total{_labels(call=name)} {histogram.snapshot()["failures"]}')
+        _header(out, 'app_ai_circuit_open', 'gauge', '1 while the Gemini circuit breaker is open.')
+        out.append(f'app_ai_circuit_open {int(ai_client.client.breaker.state == "open")}')
+
+        _header(out, 'app_jobs', 'gauge', 'Background jobs by status.')
+        for status, count in db.session.execute(select(Job.status, func.count()).group_by(Job.status)):
+            out.append(f'app_jobs{_labels(status=status)} {count}')
+        for name, extension in sorted(self.app.extensions.items()):
+            stats = getattr(extension, 'stats', None)
+            if extension is self or not callable(stats):
+                continue
+            for key, value in sorted(stats().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out.append(f'app_{name}_{key} {value}')
+        return '\n'.join(out) + '\n'
+
+
+def _sql_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_sql_start', []).append(time.perf_counter())
+
+
+def _sql_end(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_sql_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if _sql_latency is not None:
+        _sql_latency.observe(elapsed)
+    if has_request_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+
+def _render_start(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('render_starts', []).append(time.perf_counter())
+
+
+def _header(out, name, kind, help_text):
+    out.append(f'# HELP {name} {help_text}')
+    out.append(f'# TYPE {name} {kind}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _histograms(out, name, help_text, label_names, histograms):
+    _header(out, name, 'histogram', help_text)
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        snapshot = histogram.snapshot()
+        cumulative = 0
+        for bound, count in snapshot['buckets'].items():
+            cumulative += count
+            le = '+Inf' if math.isinf(bound) else f'{bound:g}'
+            out.append(f'{name}_bucket{_labels(**labels, le=le)} {cumulative}')
+        out.append(f'{name}_sum{_labels(**labels)} {snapshot["sum"]:.6f}')
+        out.append(f'{name}_count{_labels(**labels)} {snapshot["count"]}')
@@ -0,0 +1,174 @@
+# MIGRATIONS - versioned schema changes instead of create_all() at import time
+#
+# Each migration is a function registered with @migration(version, description)
+# and gets a connection inside the upgrade transaction. Applied versions are
+# recorded in the schema_migrations table, so every database (fresh, or created
+# by the old create_all()) is brought forward by exactly the steps it is missing.
+# Migrations only ever add to what earlier ones did and are written to be safe to
+# re-run (IF NOT EXISTS, column checks), because version 1 builds a fresh database
+# straight from the current models. On PostgreSQL an advisory lock makes
+# concurrently booting workers wait for each other instead of racing.
+#
+#   flask --app app db upgrade     # apply pending migrations
+#   flask --app app db status      # list applied / pending versions
+
+import logging
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, inspect, literal, select, text
+from models import db, User, PointsEvent, DailyTaskArchive, RolloverRun
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS = {}
+# Arbitrary constant for pg_advisory_xact_lock
+ADVISORY_LOCK_ID = 7_240_113
+
+
+def migration(version, description):
+    def decorator(func):
+        if version in MIGRATIONS:
+            raise ValueError(f'Duplicate migration version {version}')
+        MIGRATIONS[version] = (description, func)
+        return func
+    return decorator
+
+
+def create_index(conn, name, table, *columns):
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} ({', '.join(map(quote, columns))})"))
+
+
+def add_column(conn, table, column, ddl):
+    if column not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        quote = conn.dialect.identifier_preparer.quote
+        conn.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}'))
+
+
+class Migrations:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # Turn off when a deploy step runs `flask db upgrade` before the workers start
+        app.config.setdefault('MIGRATE_ON_STARTUP', True)
+        app.extensions['migrations'] = self
+        app.cli.add_command(self._cli())
+        # startup.py calls upgrade() on the first app context when MIGRATE_ON_STARTUP is on,
+        # but not for CLI commands, so `db status` and `db upgrade` see the real state
+
+    def _ensure_table(self, conn):
+        conn.execute(text('CREATE TABLE IF NOT EXISTS schema_migrations ('
+                          'version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'))
+
+    def applied(self, conn):
+        return {version for (version,) in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+    def pending(self):
+        with db.engine.begin() as conn:
+            self._ensure_table(conn)
+            applied = self.applied(conn)
+        return [version for version in sorted(MIGRATIONS) if version not in applied]
+
+    def upgrade(self):
+        # One transaction for the whole run; PostgreSQL rolls back DDL too
+        applied_now = []
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': ADVISORY_LOCK_ID})
+            self._ensure_table(conn)
+            done = self.applied(conn)
+            for version in sorted(MIGRATIONS):
+                if version in done:
+                    continue
+                description, func = MIGRATIONS[version]
+                func(conn)
+                conn.execute(text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                             {'v': version, 'd': description, 't': datetime.utcnow()})
+                applied_now.append(version)
+                log.info('applied migration %d: %s', version, description)
+        return applied_now
+
+    def _cli(self):
+        group = AppGroup('db', help='Database schema migrations.')
+
+        @group.command('upgrade')
+        def upgrade_command():
+            applied = self.upgrade()
+            click.echo(f"Applied migrations: {', '.join(map(str, applied))}" if applied else 'Database is up to date.')
+
+        @group.command('status')
+        def status_command():
+            pending = set(self.pending())
+            for version in sorted(MIGRATIONS):
+                click.echo(f"{version:4d}  {'pending' if version in pending else 'applied':8}  {MIGRATIONS[version][0]}")
+
+        return group
+
+
+# --- Migrations (append only) ---
+
+@migration(1, 'baseline schema')
+def baseline(conn):
+    # Creates whatever tables are missing; databases from the create_all() days keep theirs
+    db.metadata.create_all(conn)
+
+
+# Indexes behind the hot lookups: login/load_user, the dashboard's active journey and
+# its milestones/tasks, task-by-target, group membership and targets, leaderboard
+# ordering, job claiming and the cache prunes. Mirrors the index declarations in models.py.
+HOT_PATH_INDEXES = [
+    ('ix_user_points', 'user', 'points'),
+    ('ix_user_group_id_points', 'user', 'group_id', 'points'),
+    ('ix_journey_user_id_active', 'journey', 'user_id', 'active'),
+    ('ix_milestone_journey_id', 'milestone', 'journey_id'),
+    ('ix_daily_task_milestone_id', 'daily_task', 'milestone_id'),
+    ('ix_daily_task_target_id', 'daily_task', 'target_id'),
+    ('ix_group_target_group_id', 'group_target', 'group_id'),
+    ('ix_group_target_completions_group_target_id', 'group_target_completions', 'group_target_id'),
+    ('ix_job_status_run_at', 'job', 'status', 'run_at'),
+    ('ix_job_user_id_status', 'job', 'user_id', 'status'),
+    ('ix_plan_cache_entry_last_used_at', 'plan_cache_entry', 'last_used_at'),
+    ('ix_plan_cache_entry_created_at', 'plan_cache_entry', 'created_at'),
+    ('ix_verification_result_created_at', 'verification_result', 'created_at'),
+]
+
+
+@migration(2, 'hot path indexes')
+def hot_path_indexes(conn):
+    for name, table, *columns in HOT_PATH_INDEXES:
+        create_index(conn, name, table, *columns)
+
+
+@migration(3, 'points ledger')
+def points_ledger(conn):
+    PointsEvent.__table__.create(conn, checkfirst=True)
+    # Opening balance so that User.points == SUM(points_event.amount) holds from here on
+    conn.execute(PointsEvent.__table__.insert().from_select(
+        ['user_id', 'amount', 'reason', 'created_at'],
+        select(User.id, User.points, literal('opening_balance'), literal(datetime.utcnow(), DateTime)).where(User.points != 0)))
+
+
+@migration(4, 'group version for the group page cache')
+def group_version(conn):
+    add_column(conn, 'group', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(5, 'daily rollover: streak/last_login indexes, journey archiving')
+def daily_rollover(conn):
+    create_index(conn, 'ix_user_streak', 'user', 'streak')
+    create_index(conn, 'ix_user_last_login', 'user', 'last_login')
+    # Journeys from before this migration get no created_at and count as old
+    add_column(conn, 'journey', 'created_at', 'TIMESTAMP')
+    add_column(conn, 'journey', 'archived_at', 'TIMESTAMP')
+    DailyTaskArchive.__table__.create(conn, checkfirst=True)
+    RolloverRun.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, 'journey replaced_at for archiving')
+def journey_replaced_at(conn):
+    # Journeys replaced before this migration keep NULL; the rollover falls back to created_at for them
+    add_column(conn, 'journey', 'replaced_at', 'TIMESTAMP')
@@ -0,0 +1,158 @@
+# DATABASE MODELS - shared by the web routes and the background workers
+
+from datetime import datetime, date
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+db = SQLAlchemy()
+
+group_target_completions = db.Table('group_target_completions',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key= True),
+    db.Column('group_target_id', db.Integer, db.ForeignKey('group_target.id'), primary_key=True),
+    # The primary key only serves lookups by user; "who completed this target" goes through here
+    db.Index('ix_group_target_completions_group_target_id', 'group_target_id')
+)
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    password_hash = db.Column(db.String(150), nullable=False)
+    points = db.Column(db.Integer, default= 0, index=True)
+    # Indexed for streak rankings and "active today" counts; kept current by rollover.py
+    streak = db.Column(db.Integer, default=0, index=True)
+    last_login = db.Column(db.Date, default=date.today, index=True)
+    last_target_date = db.Column(db.Date)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
+    journeys = db.relationship('Journey', backref='user', lazy=True, cascade="all, delete-orphan")
+    # Per-group leaderboards
+    __table_args__ = (db.Index('ix_user_group_id_points', 'group_id', 'points'),)
+
+    def set_password(self, password): self.password_hash = generate_password_hash(password)
+    def check_password(self, password): return check_password_hash(self.password_hash, password)
+
+class Target(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    verification_required = db.Column(db.Boolean, default=False)
+    verification_status = db.Column(db.String(20), default='not_required')
+
+class Group(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    # Bumped by every join/leave/new target/completion; keys the rendered group page (group_cache.py)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    members = db.relationship('User', backref='group', lazy=True)
+    targets = db.relationship('GroupTarget', backref='group', lazy=True, cascade="all, delete-orphan")
+
+class GroupTarget(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    # Never load this for a page - group_cache.py counts completions with aggregate queries
+    completed_by = db.relationship('User', secondary=group_target_completions, lazy=True, backref=db.backref('completed_group_targets', lazy=True))
+
+class Journey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    original_goal = db.Column(db.Text, nullable=False)
+    active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set when another journey of the user becomes the active one (materialize.py)
+    replaced_at = db.Column(db.DateTime)
+    # Set when rollover.py moves the tasks of an old, inactive journey to daily_task_archive
+    archived_at = db.Column(db.DateTime)
+    milestones = db.relationship('Milestone', backref='journey', lazy=True, cascade="all, delete-orphan")
+    # The dashboard's "current journey of this user" lookup
+    __table_args__ = (db.Index('ix_journey_user_id_active', 'user_id', 'active'),)
+
+class Milestone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    journey_id = db.Column(db.Integer, db.ForeignKey('journey.id'), nullable=False, index=True)
+    week = db.Column(db.Integer, nullable=False)
+    goal = db.Column(db.String(300), nullable=False)
+    daily_tasks = db.relationship('DailyTask', backref='milestone', lazy=True, cascade="all, delete-orphan")
+
+class DailyTask(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    milestone_id = db.Column(db.Integer, db.ForeignKey('milestone.id'), nullable=False, index=True)
+    task = db.Column(db.String(300), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    target_id = db.Column(db.Integer, db.ForeignKey('target.id'), index=True)
+    target = db.relationship('Target', backref='daily_task', uselist=False)
+
+# Tasks of archived journeys (see rollover.py), moved out of the hot daily_task table
+class DailyTaskArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    milestone_id = db.Column(db.Integer, nullable=False, index=True)
+    task = db.Column(db.String(300), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    target_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# One row per day the rollover ran (see rollover.py); the primary key lets only one worker run it
+class RolloverRun(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    streaks_reset = db.Column(db.Integer, nullable=False, default=0)
+    journeys_archived = db.Column(db.Integer, nullable=False, default=0)
+    tasks_archived = db.Column(db.Integer, nullable=False, default=0)
+
+# Background jobs (see jobs.py). status: queued -> running -> done / failed
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    # Claiming due jobs, and the dashboard's "is a journey being built for me" check
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'), db.Index('ix_job_user_id_status', 'user_id', 'status'))
+
+# Cached Gemini journey plans (see plan_cache.py), keyed on sha256(prompt version + normalized goal)
+class PlanCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    goal = db.Column(db.Text, nullable=False)
+    prompt_version = db.Column(db.Integer, nullable=False)
+    plan = db.Column(db.Text, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Past AI photo verdicts (see verification_cache.py). The 64-bit dHash is split into
+# five bands so near-duplicates can be found with indexed lookups.
+class VerificationResult(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title_key = db.Column(db.String(64), nullable=False, index=True)
+    phash = db.Column(db.BigInteger, nullable=False)
+    band0 = db.Column(db.Integer, nullable=False, index=True)
+    band1 = db.Column(db.Integer, nullable=False, index=True)
+    band2 = db.Column(db.Integer, nullable=False, index=True)
+    band3 = db.Column(db.Integer, nullable=False, index=True)
+    band4 = db.Column(db.Integer, nullable=False, index=True)
+    verdict = db.Column(db.String(20), nullable=False)
+    target_id = db.Column(db.Integer, db.ForeignKey('target.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Append-only points ledger (see points.py). User.points is the running total of these
+# rows; idempotency_key makes each award happen at most once.
+class PointsEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(30), nullable=False)
+    idempotency_key = db.Column(db.String(100), unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
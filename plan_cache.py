@@ -0,0 +1,120 @@
+# PLAN CACHE - reuse Gemini journey plans for (near) identical goals
+#
+# "learn python in 4 weeks" and "Learn Python in 4 weeks!" normalize to the same
+# goal, so they share one cached plan. Only punctuation at the edges of a word is
+# dropped, so "C++", "C#" and "C" stay three different goals. Plans are stored in the plan_cache_entry
+# table (shared by every worker) with a small in-process LRU in front of it.
+# The key includes the prompt version, so changing the prompt retires old plans.
+
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from models import db, PlanCacheEntry
+
+# Bumped whenever normalize_goal changes, so keys made the old way are never matched
+NORMALIZE_VERSION = 2
+# Punctuation before or after a word ("weeks!", "(python)"); + and # are part of words like C++ and C#
+EDGE_PUNCTUATION = re.compile(r'(?<!\S)[^\w\s+#]+|[^\w\s+#]+(?!\S)')
+
+
+def normalize_goal(goal):
+    goal = unicodedata.normalize('NFKC', goal).casefold()
+    goal = EDGE_PUNCTUATION.sub(' ', goal)
+    return ' '.join(goal.split())
+
+
+class PlanCache:
+    def __init__(self, app=None, prompt_version=1):
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('PLAN_CACHE_ENABLED', True)
+        app.config.setdefault('PLAN_CACHE_TTL', 30 * 24 * 3600)
+        app.config.setdefault('PLAN_CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('PLAN_CACHE_LRU_SIZE', 256)
+        app.extensions['plan_cache'] = self
+
+    def key(self, goal):
+        return hashlib.sha256(f'{self.prompt_version}:{NORMALIZE_VERSION}:{normalize_goal(goal)}'.encode()).hexdigest()
+
+    def get(self, goal):
+        if not self.app.config['PLAN_CACHE_ENABLED']:
+            return None
+        key = self.key(goal)
+        now = datetime.utcnow()
+        ttl = timedelta(seconds=self.app.config['PLAN_CACHE_TTL'])
+
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None and now - cached[1] < ttl:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+
+        entry = db.session.get(PlanCacheEntry, key)
+        if entry is None or now - entry.created_at >= ttl:
+            with self._lock:
+                self._lru.pop(key, None)
+                self.misses += 1
+            return None
+
+        # Bookkeeping only - committed together with whatever the caller writes next
+        entry.hits += 1
+        entry.last_used_at = now
+        plan = json.loads(entry.plan)
+        self._remember(key, plan, entry.created_at)
+        with self._lock:
+            self.hits += 1
+        return plan
+
+    def put(self, goal, plan):
+        # Commits the current session, so call it before writing anything else
+        if not self.app.config['PLAN_CACHE_ENABLED']:
+            return
+        key = self.key(goal)
+        now = datetime.utcnow()
+        entry = db.session.get(PlanCacheEntry, key) or PlanCacheEntry(key=key, hits=0)
+        entry.goal = normalize_goal(goal)
+        entry.prompt_version = self.prompt_version
+        entry.plan = json.dumps(plan)
+        entry.created_at = entry.last_used_at = now
+        db.session.add(entry)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same goal first; its plan is just as good
+            db.session.rollback()
+        self._remember(key, plan, now)
+        self.prune()
+
+    def prune(self):
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=self.app.config['PLAN_CACHE_TTL'])
+        PlanCacheEntry.query.filter(PlanCacheEntry.created_at < expired).delete(synchronize_session=False)
+        overflow = db.session.query(PlanCacheEntry.key).order_by(PlanCacheEntry.last_used_at.desc()).offset(self.app.config['PLAN_CACHE_MAX_ENTRIES'])
+        PlanCacheEntry.query.filter(PlanCacheEntry.key.in_(overflow.scalar_subquery())).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _remember(self, key, plan, stored_at):
+        with self._lock:
+            self._lru[key] = (plan, stored_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.app.config['PLAN_CACHE_LRU_SIZE']:
+                self._lru.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0, 'lru_size': len(self._lru)}
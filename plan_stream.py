@@ -0,0 +1,79 @@
+# PLAN STREAM - pull the journey title and milestones out of a half-received plan
+#
+# streamGenerateContent hands the plan JSON over in arbitrary text fragments.
+# PlanStreamParser is fed those fragments and tracks string/escape state and
+# bracket depth, so every milestone object is emitted (json.loads'ed) as soon
+# as its closing brace arrives, and the title as soon as its string closes.
+# Text before the first '{' (e.g. a ```json fence) is skipped. The complete
+# text is still parsed and shape-checked at the end by the caller.
+
+import json
+
+
+class PlanStreamParser:
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.started = False
+        self.stack = []          # '{' / '[' for every open container
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.expect_key = False  # only tracked for the top-level object
+        self.last_key = None
+        self.milestones_depth = None
+        self.milestone_start = None
+
+    def feed(self, fragment):
+        # Returns a list of ('title', str) / ('milestone', dict) events completed by this fragment
+        self.text += fragment
+        events = []
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                    self.stack.append('{')
+                    self.expect_key = True
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._string_closed(events)
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = self.pos
+            elif ch in '{[':
+                self.stack.append(ch)
+                if ch == '[' and len(self.stack) == 2 and self.last_key == 'milestones':
+                    self.milestones_depth = 2
+                elif ch == '{' and self.milestones_depth and len(self.stack) == self.milestones_depth + 1:
+                    self.milestone_start = self.pos
+            elif ch in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if ch == '}' and self.milestone_start is not None and len(self.stack) == self.milestones_depth:
+                    events.append(('milestone', json.loads(text[self.milestone_start:self.pos + 1])))
+                    self.milestone_start = None
+                elif ch == ']' and len(self.stack) == 1 and self.milestones_depth:
+                    self.milestones_depth = None
+            elif len(self.stack) == 1:
+                if ch == ':':
+                    self.expect_key = False
+                elif ch == ',':
+                    self.expect_key = True
+            self.pos += 1
+        return events
+
+    def _string_closed(self, events):
+        if len(self.stack) != 1:
+            return
+        value = json.loads(self.text[self.string_start:self.pos + 1])
+        if self.expect_key:
+            self.last_key = value
+        elif self.last_key == 'journey_title':
+            events.append(('title', value))
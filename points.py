@@ -0,0 +1,111 @@
+# POINTS LEDGER - every point a user earns is a row in points_event
+#
+# An award appends one event and bumps User.points with a single
+# UPDATE ... SET points = points + :n in the caller's transaction, so concurrent
+# requests in different workers never lose each other's points. Each award
+# carries an idempotency key (e.g. "task:42"). The key is UNIQUE and inserted
+# with ON CONFLICT DO NOTHING, so a double-submitted form or a racing second
+# request finds the key already taken and awards nothing. The daily login bonus
+# and streak are one conditional UPDATE on the user row.
+#
+# Invariant: User.points == SUM(points_event.amount) for every user. compact()
+# keeps the table small by folding events older than POINTS_LEDGER_RETENTION_DAYS
+# into one 'compacted' row per user (the sum is unchanged). The old idempotency
+# keys go with them, and by then the task/target rows' own completed flags guard
+# against repeats. The daily rollover (rollover.py) runs it; it is never run
+# from a user's request, since it rewrites the whole ledger under the write lock.
+#
+#   flask --app app points compact   # fold old events
+#   flask --app app points check     # list users whose points drifted from the ledger
+
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, case, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, User, PointsEvent
+import user_cache
+
+
+def insert_ignore(table):
+    # INSERT ... ON CONFLICT DO NOTHING (PostgreSQL and SQLite >= 3.24); rowcount is 0 when skipped
+    insert = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    return insert(table).on_conflict_do_nothing()
+
+
+class PointsLedger:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('POINTS_LEDGER_RETENTION_DAYS', 30)
+        app.extensions['points_ledger'] = self
+        app.cli.add_command(self._cli())
+
+    def _append(self, user_id, amount, reason, key):
+        return db.session.execute(insert_ignore(PointsEvent.__table__).values(
+            user_id=user_id, amount=amount, reason=reason, idempotency_key=key, created_at=datetime.utcnow())).rowcount == 1
+
+    def award(self, user_id, amount, reason, key=None):
+        # True when the points were added; False when `key` had already been awarded.
+        # The caller commits.
+        if not self._append(user_id, amount, reason, key):
+            return False
+        db.session.execute(update(User).where(User.id == user_id).values(points=User.points + amount))
+        user_cache.stale(user_id)
+        return True
+
+    def daily_login(self, user, amount, today):
+        # +amount and streak bookkeeping, at most once per user per day. True when awarded.
+        yesterday = today - timedelta(days=1)
+        claimed = db.session.execute(
+            update(User).where(User.id == user.id, User.last_login < today)
+            .values(points=User.points + amount, last_login=today,
+                    streak=case((User.last_login == yesterday, User.streak + 1), else_=0))
+            .execution_options(synchronize_session=False)).rowcount
+        if not claimed:
+            return False
+        self._append(user.id, amount, 'daily_login', f'login:{user.id}:{today.isoformat()}')
+        user_cache.stale(user.id)
+        db.session.expire(user, ['points', 'streak', 'last_login'])
+        return True
+
+    def compact(self, before=None):
+        # Folds every event older than `before` into one row per user, in the caller's transaction
+        before = before or datetime.utcnow() - timedelta(days=self.app.config['POINTS_LEDGER_RETENTION_DAYS'])
+        last_id = db.session.scalar(select(func.max(PointsEvent.id)).where(PointsEvent.created_at < before))
+        if last_id is None:
+            return 0
+        old = (PointsEvent.id <= last_id, PointsEvent.created_at < before)
+        db.session.execute(PointsEvent.__table__.insert().from_select(
+            ['user_id', 'amount', 'reason', 'created_at'],
+            select(PointsEvent.user_id, func.sum(PointsEvent.amount), literal('compacted'), literal(before, DateTime)).where(*old).group_by(PointsEvent.user_id)))
+        return db.session.execute(delete(PointsEvent).where(*old).execution_options(synchronize_session=False)).rowcount
+
+    def drift(self):
+        # (user_id, points, ledger total) for every user whose points don't match the ledger
+        ledger = select(PointsEvent.user_id, func.sum(PointsEvent.amount).label('total')).group_by(PointsEvent.user_id).subquery()
+        total = func.coalesce(ledger.c.total, 0)
+        return db.session.execute(select(User.id, User.points, total).outerjoin(ledger, ledger.c.user_id == User.id)
+                                  .where(func.coalesce(User.points, 0) != total)).all()
+
+    def _cli(self):
+        group = AppGroup('points', help='Points ledger maintenance.')
+
+        @group.command('compact')
+        def compact_command():
+            folded = self.compact()
+            db.session.commit()
+            click.echo(f'Compacted {folded} ledger events.')
+
+        @group.command('check')
+        def check_command():
+            drifted = self.drift()
+            for user_id, points, total in drifted:
+                click.echo(f'user {user_id}: points {points}, ledger {total}')
+            click.echo(f'{len(drifted)} users out of step with the ledger.')
+
+        return group
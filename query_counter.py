@@ -0,0 +1,56 @@
+# QUERY COUNTER - how many SQL statements did this request run?
+#
+# Every statement executed while a request is active is counted on flask.g.
+# In debug/testing mode (or with QUERY_COUNT_HEADER on) the total is sent back
+# as an X-Query-Count header, and views decorated with @query_budget(n) log a
+# warning - or fail outright when app.testing is set - if they go over budget.
+
+import functools
+import logging
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def query_count():
+    return g.get('query_count', 0) if has_request_context() else 0
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_COUNT_HEADER', False)
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.debug or app.testing or app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(query_count())
+        return response
+
+
+def query_budget(limit):
+    # Put it under @login_required so the user load is part of the count
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            used = query_count()
+            if used > limit:
+                message = f'{request.endpoint} ran {used} SQL queries (budget is {limit})'
+                if current_app.testing:
+                    raise QueryBudgetExceeded(message)
+                log.warning(message)
+            return response
+        return wrapper
+    return decorator
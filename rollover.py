@@ -0,0 +1,181 @@
+# DAILY ROLLOVER - once-a-day upkeep for every user, in a few set-based statements
+#
+# Login only claims the day's bonus (one conditional UPDATE on one row, see
+# points.py), so users who stop logging in would keep their streak forever and
+# any ranking by streak would be wrong. Once a day, shortly after midnight
+# (local time, like date.today() in the login route), the rollover:
+#
+#   - resets the streak of everyone who missed yesterday (UPDATE ... WHERE
+#     last_login < yesterday, in primary-key ranges of ROLLOVER_BATCH_SIZE users)
+#   - archives journeys that were replaced more than ROLLOVER_ARCHIVE_DAYS ago
+#     (journey.replaced_at; journeys replaced before that column existed, and
+#     plans that were never activated, go by created_at instead): their tasks move to daily_task_archive (INSERT ... SELECT + DELETE per
+#     batch of journeys), keeping daily_task to the journeys people actually use
+#   - compacts the points ledger (PointsLedger.compact, see points.py)
+#
+# Bonus eligibility needs no precomputing: it is last_login < today, which the
+# login UPDATE checks on the user's own row. Every step is idempotent and each
+# batch commits on its own, so a run that dies halfway is simply run again.
+#
+# A day is claimed with a row in rollover_run, so one worker (or cron) runs it.
+# It runs as a 'daily_rollover' job that queues the next one when it is done.
+# Each gunicorn worker makes sure one is queued when it starts
+# (post_worker_init in gunicorn.conf.py), never on the request path. Elsewhere
+# it is queued from the CLI, or cron runs it directly:
+#
+#   flask --app app rollover schedule
+#   flask --app app rollover run [--day 2024-05-01]
+#   flask --app app rollover status
+
+from datetime import date, datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, delete, func, literal, select, update
+from models import db, User, Journey, Milestone, DailyTask, DailyTaskArchive, RolloverRun, Job
+from points import insert_ignore
+
+
+class DailyRollover:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('ROLLOVER_ENABLED', True)
+        app.config.setdefault('ROLLOVER_BATCH_SIZE', 5000)
+        app.config.setdefault('ROLLOVER_ARCHIVE_DAYS', 30)
+        app.config.setdefault('ROLLOVER_DELAY_MINUTES', 5)
+        # A claimed day whose run hasn't finished after this long is taken over
+        app.config.setdefault('ROLLOVER_LEASE_SECONDS', 3600)
+        app.extensions['rollover'] = self
+        app.cli.add_command(self._cli())
+        self.job_queue = app.extensions['job_queue']
+        self.job_queue.handler('daily_rollover')(self._job)
+
+    # Scheduling
+
+    def start(self):
+        # For worker start-up: makes sure the next run is queued. schedule() doesn't
+        # enqueue when a run is already queued, so the threads are started here too.
+        if not self.app.config['ROLLOVER_ENABLED']:
+            return None
+        self.job_queue.start()
+        with self.app.app_context():
+            try:
+                return self.schedule()
+            finally:
+                db.session.remove()
+
+    def schedule(self, current_job_id=None):
+        # Queues the next run unless one is already queued: now if today hasn't been done, else after midnight
+        pending = db.session.scalar(select(Job.id).where(Job.kind == 'daily_rollover', Job.status.in_(('queued', 'running')),
+                                                         Job.id != current_job_id).limit(1))
+        if pending is not None:
+            return None
+        if db.session.get(RolloverRun, date.today()) is None:
+            run_at = datetime.utcnow()
+        else:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            run_at = datetime.utcnow() + (midnight - now) + timedelta(minutes=self.app.config['ROLLOVER_DELAY_MINUTES'])
+        return self.job_queue.enqueue('daily_rollover', {}, run_at=run_at)
+
+    def _job(self, payload, job):
+        result = self.run()
+        self.schedule(current_job_id=job.id)
+        return result
+
+    # The rollover itself
+
+    def _claim(self, day):
+        now = datetime.utcnow()
+        if db.session.execute(insert_ignore(RolloverRun.__table__).values(day=day, started_at=now)).rowcount:
+            db.session.commit()
+            return True
+        expired = now - timedelta(seconds=self.app.config['ROLLOVER_LEASE_SECONDS'])
+        taken_over = db.session.execute(update(RolloverRun).where(RolloverRun.day == day, RolloverRun.finished_at.is_(None), RolloverRun.started_at < expired)
+                                        .values(started_at=now).execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        return bool(taken_over)
+
+    def run(self, day=None, force=False):
+        # Counts of what changed, or None when the day was already done (or is being done elsewhere)
+        day = day or date.today()
+        if not self._claim(day) and not force:
+            return None
+        counts = {'streaks_reset': self.reset_streaks(day), **self.archive_journeys(day)}
+        db.session.execute(update(RolloverRun).where(RolloverRun.day == day)
+                           .values(finished_at=datetime.utcnow(), **counts).execution_options(synchronize_session=False))
+        db.session.commit()
+        ledger = self.app.extensions.get('points_ledger')
+        if ledger is not None:
+            counts['ledger_events_compacted'] = ledger.compact()
+            db.session.commit()
+        cache = self.app.extensions.get('user_cache')
+        if cache is not None and counts['streaks_reset']:
+            cache.clear()
+        return counts
+
+    def reset_streaks(self, day):
+        yesterday = day - timedelta(days=1)
+        batch = self.app.config['ROLLOVER_BATCH_SIZE']
+        last_id = db.session.scalar(select(func.max(User.id))) or 0
+        reset = 0
+        for start in range(0, last_id, batch):
+            reset += db.session.execute(update(User).where(User.id > start, User.id <= start + batch, User.last_login < yesterday, User.streak != 0)
+                                        .values(streak=0).execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+        return reset
+
+    def archive_journeys(self, day):
+        cutoff = datetime.combine(day, datetime.min.time()) - timedelta(days=self.app.config['ROLLOVER_ARCHIVE_DAYS'])
+        batch = self.app.config['ROLLOVER_BATCH_SIZE']
+        journeys = tasks = 0
+        last_id = 0
+        while True:
+            journey_ids = list(db.session.scalars(
+                select(Journey.id).where(Journey.id > last_id, Journey.active == False, Journey.archived_at.is_(None),
+                                         (Journey.replaced_at < cutoff) |
+                                         (Journey.replaced_at.is_(None) & (Journey.created_at.is_(None) | (Journey.created_at < cutoff))))
+                .order_by(Journey.id).limit(batch)))
+            if not journey_ids:
+                return {'journeys_archived': journeys, 'tasks_archived': tasks}
+            last_id = journey_ids[-1]
+            milestone_ids = select(Milestone.id).where(Milestone.journey_id.in_(journey_ids))
+            now = datetime.utcnow()
+            db.session.execute(DailyTaskArchive.__table__.insert().from_select(
+                ['id', 'milestone_id', 'task', 'completed', 'target_id', 'archived_at'],
+                select(DailyTask.id, DailyTask.milestone_id, DailyTask.task, DailyTask.completed, DailyTask.target_id,
+                       literal(now, DateTime)).where(DailyTask.milestone_id.in_(milestone_ids))))
+            tasks += db.session.execute(delete(DailyTask).where(DailyTask.milestone_id.in_(milestone_ids))
+                                        .execution_options(synchronize_session=False)).rowcount
+            journeys += db.session.execute(update(Journey).where(Journey.id.in_(journey_ids)).values(archived_at=now)
+                                           .execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+
+    def _cli(self):
+        group = AppGroup('rollover', help='Daily streak and journey upkeep.')
+
+        @group.command('run')
+        @click.option('--day', type=click.DateTime(formats=['%Y-%m-%d']), help='Day to roll over to (default: today).')
+        @click.option('--force', is_flag=True, help='Run even if the day was already done.')
+        def run_command(day, force):
+            counts = self.run(day.date() if day else None, force=force)
+            click.echo('Already done for that day.' if counts is None else
+                       ', '.join(f"{value} {name.replace('_', ' ')}" for name, value in counts.items()))
+
+        @group.command('schedule')
+        def schedule_command():
+            job = self.schedule()
+            self.job_queue.stop()  # lets a run that is due now finish before the command exits
+            click.echo('A run is already queued.' if job is None else f'Queued job {job.id} for {job.run_at:%Y-%m-%d %H:%M} UTC.')
+
+        @group.command('status')
+        def status_command():
+            for run in RolloverRun.query.order_by(RolloverRun.day.desc()).limit(7):
+                state = f'finished {run.finished_at:%H:%M:%S}' if run.finished_at else f'started {run.started_at:%H:%M:%S}, not finished'
+                click.echo(f'{run.day}  {state}  {run.streaks_reset} streaks reset, '
+                           f'{run.journeys_archived} journeys / {run.tasks_archived} tasks archived')
+
+        return group
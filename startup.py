@@ -0,0 +1,101 @@
+# STARTUP - nothing slow at import time, and workers that start warm
+#
+# Importing app.py only configures the app and registers its routes. Getting
+# ready to serve happens once per process, the first time an app context is
+# pushed (the first request, job or CLI command):
+#
+#   - the instance folder is created and, with MIGRATE_ON_STARTUP, pending
+#     migrations are applied (see migrations.py) - except under `flask`
+#     commands other than `flask run`, so `flask db status` shows what is
+#     pending and `flask db upgrade` is what applies it
+#
+# Templates are compiled through a Jinja bytecode cache in TEMPLATE_CACHE_DIR,
+# a folder every worker on the host shares and which survives restarts, so only
+# the first process to render a template after a deploy compiles it. The other
+# workers load the compiled code from there.
+#
+# create_app() in app.py does all of this up front and also loads every template
+# into memory. Under gunicorn with preload_app (gunicorn.conf.py), that happens
+# once in the master, and the workers are forked already migrated and with
+# compiled templates, so their first request costs no more than any other.
+#
+#   flask --app app templates compile   # fill the bytecode cache, e.g. while building the image
+
+import os
+import threading
+import time
+import click
+from flask import appcontext_pushed
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+
+class Startup:
+    def __init__(self, app=None):
+        self._ready = False
+        self._lock = threading.Lock()
+        self.ready_seconds = 0.0
+        self.templates = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # '' = no bytecode cache; every worker compiles each template on its first render
+        app.config.setdefault('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+        app.extensions['startup'] = self
+        app.cli.add_command(self._cli())
+        if app.config['TEMPLATE_CACHE_DIR']:
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+        appcontext_pushed.connect(self._on_app_context, app)
+
+    def _on_app_context(self, sender, **kwargs):
+        if not self._ready:
+            self.ready()
+
+    def ready(self):
+        # Once per process; workers forked from a preloaded master inherit the flag
+        with self._lock:
+            if self._ready:
+                return
+            t0 = time.perf_counter()
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            if self.app.config['TEMPLATE_CACHE_DIR']:
+                os.makedirs(self.app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+            migrations = self.app.extensions.get('migrations')
+            if migrations is not None and self.app.config.get('MIGRATE_ON_STARTUP') and self._cli_command() in (None, 'run'):
+                migrations.upgrade()
+            self.ready_seconds = time.perf_counter() - t0
+            self._ready = True
+
+    @staticmethod
+    def _cli_command():
+        # The `flask` command being run in this thread, if any
+        ctx = click.get_current_context(silent=True)
+        return ctx.command.name if ctx is not None else None
+
+    def template_names(self):
+        folder = os.path.join(self.app.root_path, self.app.template_folder)
+        return sorted(name for name in os.listdir(folder) if name.endswith('.html'))
+
+    def warm_templates(self):
+        # Loads every template into the environment's cache (from the bytecode cache when it has them)
+        self.templates = self.template_names()
+        for name in self.templates:
+            self.app.jinja_env.get_template(name)
+        return self.templates
+
+    def stats(self):
+        return {'ready_seconds': self.ready_seconds, 'templates_warmed': len(self.templates)}
+
+    def _cli(self):
+        group = AppGroup('templates', help='Template compilation.')
+
+        @group.command('compile')
+        def compile_command():
+            names = self.warm_templates()
+            where = self.app.config['TEMPLATE_CACHE_DIR']
+            click.echo(f'Compiled {len(names)} templates into {where}.' if where else
+                       f'Compiled {len(names)} templates; TEMPLATE_CACHE_DIR is off, so nothing was kept.')
+
+        return group
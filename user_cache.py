@@ -0,0 +1,210 @@
+# USER CACHE - the logged-in user without a query on every request
+#
+# login_manager.user_loader asks this cache first. It keeps a snapshot of the
+# user row (and the name of their group, which groups.html and the group routes
+# read through current_user.group) and turns it back into a User attached to
+# the session without a SELECT. Anything the snapshot doesn't hold (e.g.
+# Group.version) is loaded on first use as usual.
+#
+# Entries expire after USER_CACHE_TTL seconds and are dropped as soon as a
+# change commits: ORM changes to a User (group_id, ...) are picked up from the
+# flush, and Core UPDATEs that bypass the ORM (the points ledger) call stale().
+#
+# USER_CACHE_BACKEND=memory keeps the cache per worker process, so other
+# workers see a change only when their entry expires. With
+# USER_CACHE_BACKEND=sqlite:////path/to/file every worker on the host shares
+# one SQLite file, and a change in one worker is seen by all of them at once.
+#
+# Snapshots never hold the password hash (login reads the user row itself) and
+# are stored as JSON, so nothing read back from the shared file is executable.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import configure_mappers, joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, User, Group
+
+USER_COLUMNS = [column.key for column in User.__table__.columns if column.key != 'password_hash']
+DATE_COLUMNS = {column.key for column in User.__table__.columns if column.type.python_type is date}
+
+
+def stale(user_id):
+    # Call in the same transaction as a Core UPDATE of a user row; the entry goes on commit
+    db.session.info.setdefault('stale_users', set()).add(user_id)
+
+
+class MemoryBackend:
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    # One table in a local SQLite file that every worker process opens
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # One connection per thread, and never one inherited across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS user_snapshot (user_id INTEGER PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self.conn.execute('SELECT value FROM user_snapshot WHERE user_id = ? AND expires > ?', (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        self.conn.execute('INSERT OR REPLACE INTO user_snapshot (user_id, value, expires) VALUES (?, ?, ?)',
+                          (key, json.dumps(value), time.time() + ttl))
+
+    def delete(self, keys):
+        self.conn.executemany('DELETE FROM user_snapshot WHERE user_id = ?', [(key,) for key in keys])
+
+    def clear(self):
+        self.conn.execute('DELETE FROM user_snapshot')
+
+
+class UserCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('USER_CACHE_ENABLED', True)
+        app.config.setdefault('USER_CACHE_TTL', 30)
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.config.setdefault('USER_CACHE_BACKEND', 'memory')
+        backend = app.config['USER_CACHE_BACKEND']
+        if backend.startswith('sqlite:///'):
+            self.backend = SQLiteBackend(backend[len('sqlite:///'):])
+        elif backend == 'memory':
+            self.backend = MemoryBackend(app.config['USER_CACHE_SIZE'])
+        else:
+            raise ValueError(f'Unknown USER_CACHE_BACKEND {backend!r} (expected memory or sqlite:///path).')
+        configure_mappers()  # User.group is a backref, so it exists only once the mappers are configured
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        app.extensions['user_cache'] = self
+
+        @app.after_request
+        def add_user_cache_header(response):
+            if 'user_cache' in g and (app.debug or app.testing or app.config['QUERY_COUNT_HEADER']):
+                response.headers['X-User-Cache'] = g.user_cache
+            return response
+
+    def load(self, user_id):
+        # The user_loader: a User attached to the current session, or None
+        if not self.app.config['USER_CACHE_ENABLED']:
+            return db.session.get(User, user_id)
+        snapshot = self.backend.get(user_id)
+        if snapshot is None:
+            self.misses += 1
+            self._note('miss')
+            user = db.session.get(User, user_id, options=[joinedload(User.group)])
+            if user is not None:
+                self.backend.set(user_id, self._snapshot(user), self.app.config['USER_CACHE_TTL'])
+            return user
+        self.hits += 1
+        self._note('hit')
+        return self._restore(snapshot)
+
+    def _note(self, outcome):
+        if has_request_context():
+            g.user_cache = outcome
+
+    @staticmethod
+    def _snapshot(user):
+        # Plain JSON types: dates as ISO strings
+        values = {key: getattr(user, key) for key in USER_COLUMNS}
+        for key in DATE_COLUMNS:
+            if values[key] is not None:
+                values[key] = values[key].isoformat()
+        return {'user': values,
+                'group': {'id': user.group.id, 'name': user.group.name} if user.group is not None else None}
+
+    @staticmethod
+    def _restore(snapshot):
+        # Detached-but-persistent instances merged with load=False: no SELECT, no pending changes
+        values = dict(snapshot['user'])
+        for key in DATE_COLUMNS:
+            if values[key] is not None:
+                values[key] = date.fromisoformat(values[key])
+        # password_hash is left out, so it is expired and loaded only if something reads it
+        user = User(**values)
+        group = Group(**snapshot['group']) if snapshot['group'] else None
+        make_transient_to_detached(user)
+        if group is not None:
+            make_transient_to_detached(group)
+        set_committed_value(user, 'group', group)
+        return db.session.merge(user, load=False)
+
+    def _after_flush(self, session, flush_context):
+        changed = {obj.id for obj in session.dirty if isinstance(obj, User) and session.is_modified(obj)}
+        changed |= {obj.id for obj in session.deleted if isinstance(obj, User)}
+        if changed:
+            session.info.setdefault('stale_users', set()).update(changed)
+
+    def _after_commit(self, session):
+        stale_users = session.info.pop('stale_users', None)
+        if stale_users:
+            self.invalidations += len(stale_users)
+            self.backend.delete(stale_users)
+
+    def _after_rollback(self, session):
+        session.info.pop('stale_users', None)
+
+    def clear(self):
+        # After set-based changes to many users
+        self.backend.clear()
+
+    def stats(self):
+        # Each hit is one user SELECT (plus the group lookup for group members) that didn't run
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                'hit_rate': self.hits / total if total else 0.0, 'queries_saved': self.hits}
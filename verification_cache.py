@@ -0,0 +1,94 @@
+# VERIFICATION CACHE - answer re-submitted photos without another vision call
+#
+# Every AI verdict is stored with the target title and the photo's dHash in the
+# verification_result table, shared by all workers. A new upload whose hash is
+# within VERIFICATION_CACHE_THRESHOLD bits of a stored one is a near-duplicate:
+#   - if that photo already verified a *different* target, it is being reused;
+#   - if it was judged for the same task title before, the old verdict stands.
+# Hashes are split into five bands (13/13/13/13/12 bits) and candidates are fetched
+# by exact band match, so any hash within 4 bits is always found (pigeonhole)
+# without scanning the table. Thresholds above 4 still work but may miss matches.
+
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from models import db, VerificationResult
+from plan_cache import normalize_goal
+from images import hamming
+
+CachedVerdict = namedtuple('CachedVerdict', 'verdict reused target_id distance')
+BAND_BITS = (13, 13, 13, 13, 12)
+
+
+def _signed(value):
+    # dHash is unsigned 64-bit; BIGINT columns are signed
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _bands(value):
+    bands, shift = [], 64
+    for bits in BAND_BITS:
+        shift -= bits
+        bands.append((value >> shift) & ((1 << bits) - 1))
+    return bands
+
+
+class VerificationCache:
+    def __init__(self, app=None):
+        self._stores = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('VERIFICATION_CACHE_ENABLED', True)
+        app.config.setdefault('VERIFICATION_CACHE_THRESHOLD', 4)
+        app.config.setdefault('VERIFICATION_CACHE_TTL', 90 * 24 * 3600)
+        app.config.setdefault('VERIFICATION_CACHE_MAX_ENTRIES', 100000)
+        app.extensions['verification_cache'] = self
+
+    def title_key(self, title):
+        return hashlib.sha256(normalize_goal(title).encode()).hexdigest()
+
+    def near_duplicates(self, phash):
+        bands = _bands(phash)
+        since = datetime.utcnow() - timedelta(seconds=self.app.config['VERIFICATION_CACHE_TTL'])
+        candidates = VerificationResult.query.filter(
+            VerificationResult.created_at >= since,
+            or_(*(getattr(VerificationResult, f'band{i}') == band for i, band in enumerate(bands)))).all()
+        threshold = self.app.config['VERIFICATION_CACHE_THRESHOLD']
+        matches = [(hamming(phash, entry.phash & ((1 << 64) - 1)), entry) for entry in candidates]
+        return sorted(((distance, entry) for distance, entry in matches if distance <= threshold), key=lambda match: match[0])
+
+    def lookup(self, target, phash):
+        # Returns a CachedVerdict, or None when the model has to be asked
+        if not self.app.config['VERIFICATION_CACHE_ENABLED']:
+            return None
+        title_key = self.title_key(target.title)
+        same_task = None
+        for distance, entry in self.near_duplicates(phash):
+            if entry.verdict == 'verified' and entry.target_id != target.id:
+                return CachedVerdict('rejected', True, entry.target_id, distance)
+            if same_task is None and entry.title_key == title_key:
+                same_task = (distance, entry)
+        if same_task is None:
+            return None
+        distance, entry = same_task
+        entry.hits += 1
+        return CachedVerdict(entry.verdict, False, entry.target_id, distance)
+
+    def store(self, target, phash, verdict, user_id=None):
+        bands = _bands(phash)
+        db.session.add(VerificationResult(title_key=self.title_key(target.title), phash=_signed(phash),
+                                          verdict=verdict, target_id=target.id, user_id=user_id,
+                                          **{f'band{i}': band for i, band in enumerate(bands)}))
+        self._stores += 1
+        if self._stores % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        expired = datetime.utcnow() - timedelta(seconds=self.app.config['VERIFICATION_CACHE_TTL'])
+        VerificationResult.query.filter(VerificationResult.created_at < expired).delete(synchronize_session=False)
+        overflow = db.session.query(VerificationResult.id).order_by(VerificationResult.created_at.desc()).offset(self.app.config['VERIFICATION_CACHE_MAX_ENTRIES'])
+        VerificationResult.query.filter(VerificationResult.id.in_(overflow.scalar_subquery())).delete(synchronize_session=False)